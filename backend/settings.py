@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'utility.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -76,15 +79,81 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# "wsgi" or "asgi", the entrypoint serves backend.<SERVER_MODE> with gunicorn. Under ASGI the hot movie
+# endpoints are routed to their async views, which the setting can also force on or off.
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', str(SERVER_MODE == 'asgi')).lower() in ('1', 'true', 'yes')
+
+# List endpoints build their responses from `.values()` rows instead of serializing model instances, see
+# utility.views.ValuesListMixin. The output is the same either way.
+FAST_LIST_SERIALIZATION = os.environ.get('FAST_LIST_SERIALIZATION', 'true').lower() in ('1', 'true', 'yes')
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+# SQLite by default, PostgreSQL when DATABASE_ENGINE=postgresql. Connections are kept open for CONN_MAX_AGE
+# seconds by every worker thread. Under ASGI every request runs the ORM in a new thread, so persistent
+# connections are off there unless CONN_MAX_AGE is set; put PgBouncer in front of PostgreSQL instead.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'backend'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            # PgBouncer in transaction pooling mode does not keep server-side cursors between transactions.
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_POOLER') == 'pgbouncer',
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'utility.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'pragmas': {
+                    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+                    'journal_mode': 'WAL',
+                    'synchronous': 'NORMAL',
+                    'mmap_size': 256 * 1024 * 1024,
+                    'cache_size': -64 * 1024,
+                },
+            },
+        }
+    }
+
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 0 if SERVER_MODE == 'asgi' else 600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Watchlists, responses and catalogue versions are cached here and invalidated on change, by the server's
+# worker processes as well as by management commands, so the cache lives in DJANGO_CACHE_DIR on disk where
+# all of them see it. Culling evicts random entries once MAX_ENTRIES is reached, so the catalogue versions
+# and token generations, which reset ETags and token caches when they are lost, live in the separate
+# "versions" alias that only holds a handful of entries.
+DJANGO_CACHE_DIR = os.environ.get('DJANGO_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'django-cache')
+CACHE_MAX_ENTRIES = int(os.environ.get('DJANGO_CACHE_MAX_ENTRIES', 20000))
+VERSION_CACHE_MAX_ENTRIES = int(os.environ.get('DJANGO_VERSION_CACHE_MAX_ENTRIES', 100000))
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DJANGO_CACHE_DIR, 'default'),
+        'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DJANGO_CACHE_DIR, 'versions'),
+        'OPTIONS': {'MAX_ENTRIES': VERSION_CACHE_MAX_ENTRIES},
+    },
 }
 
 
@@ -133,10 +202,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        'utility.authentication.CachedTokenAuthentication',
+    ],
+    # Number of reverse proxies in front of the app, so throttling keys on the client address in
+    # X-Forwarded-For instead of the proxy's.
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
 }
 
+# Resolved API tokens are cached per worker process. Deleting a token or saving its user replaces the
+# token's generation in the shared cache, which every process checks before using its entry.
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_CACHE_TIMEOUT', 60))
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', 10000))
+
+# Token bucket rates of the endpoints that hash passwords (register, login and reset-password), per client
+# IP and per username. Buckets live in each worker process. An empty rate disables that throttle.
+AUTH_THROTTLE_RATES = {
+    'ip': os.environ.get('AUTH_THROTTLE_IP_RATE', '30/min') or None,
+    'username': os.environ.get('AUTH_THROTTLE_USERNAME_RATE', '10/min') or None,
+}
+AUTH_THROTTLE_MAX_ENTRIES = int(os.environ.get('AUTH_THROTTLE_MAX_ENTRIES', 100000))
+
+# Share of requests timed by utility.metrics.MetricsMiddleware, from 0 to 1. Sampled requests are counted in
+# the histograms of /metrics, which is only served with the bearer token METRICS_TOKEN. Their Server-Timing
+# header is sent to staff users, and to everyone with METRICS_PUBLIC_SERVER_TIMING.
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC_SERVER_TIMING = os.environ.get('METRICS_PUBLIC_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+# Directory shared by the worker processes, where /metrics sums the histograms of all of them. Without it,
+# /metrics only covers the worker that answered. docker-entrypoint.sh sets it when it runs several workers.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
 STATIC_ROOT = "staticfiles"
 
 CORS_ALLOWED_ORIGINS = [
@@ -151,3 +246,9 @@ CSRF_TRUSTED_ORIGINS = [
 
 MEDIA_ROOT = "media/"
 MEDIA_URL = "api/media/"
+
+# How media files are sent: "sendfile" streams them from the worker with os.sendfile when the server
+# supports it, "x-accel-redirect" and "x-sendfile" only send headers and let nginx or Apache do the
+# transfer. For X-Accel-Redirect, nginx needs an internal location that maps to MEDIA_ROOT.
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'sendfile')
+MEDIA_ACCEL_REDIRECT_LOCATION = os.environ.get('MEDIA_ACCEL_REDIRECT_LOCATION', '/protected-media/')
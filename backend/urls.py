@@ -19,10 +19,11 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.views.static import serve
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 
+from utility import media, metrics
+
 schema_view = get_schema_view(
     openapi.Info(
         title="API Documentation",
@@ -36,10 +37,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('user.urls')),
     path('movie/', include('movie.urls')),
+    path('metrics', metrics.serve, name='metrics'),
     path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     re_path(
         r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/").split("/")[1] + "/"),
-        serve,
+        media.serve,
         kwargs=dict(document_root=settings.MEDIA_ROOT)
     ),
 ]
@@ -0,0 +1,32 @@
+#!/bin/sh
+set -e
+
+GUNICORN_WORKERS="${GUNICORN_WORKERS:-1}"
+# Watchlists, responses and tokens are cached on disk and shared by the workers and management commands.
+# Without DJANGO_CACHE_DIR, the server starts with an empty cache in the container.
+if [ -z "$DJANGO_CACHE_DIR" ]; then
+    export DJANGO_CACHE_DIR="/tmp/django-cache"
+    rm -rf "$DJANGO_CACHE_DIR"
+fi
+# Likewise for the metrics histograms of the workers, which must start empty.
+if [ "$GUNICORN_WORKERS" -gt 1 ] && [ -z "$METRICS_DIR" ]; then
+    export METRICS_DIR="/tmp/django-metrics"
+    rm -rf "$METRICS_DIR"
+fi
+
+python manage.py collectstatic --noinput
+python manage.py migrate
+
+SERVER_MODE="${SERVER_MODE:-wsgi}"
+case "$SERVER_MODE" in
+    wsgi) DEFAULT_WORKER_CLASS="sync" ;;
+    asgi) DEFAULT_WORKER_CLASS="uvicorn.workers.UvicornWorker" ;;
+    *) echo "SERVER_MODE must be wsgi or asgi, not $SERVER_MODE" >&2; exit 1 ;;
+esac
+
+exec gunicorn "backend.$SERVER_MODE" \
+    --bind "0.0.0.0:${PORT:-8000}" \
+    --worker-class "${GUNICORN_WORKER_CLASS:-$DEFAULT_WORKER_CLASS}" \
+    --workers "$GUNICORN_WORKERS" \
+    --threads "${GUNICORN_THREADS:-1}" \
+    --timeout "${GUNICORN_TIMEOUT:-30}"
@@ -5,7 +5,7 @@ from movie.models import Movie, MovieRating
 
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-    pass
+    readonly_fields = ["rating_count", "rating_sum", "overall_rating"]
 
 
 @admin.register(MovieRating)
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from movie import views
+from movie.models import Movie, MovieList, MovieRating
+from movie.response_cache import (
+    RESPONSE_CACHE_TIMEOUT,
+    aget_catalogue_version,
+    get_response_cache_key,
+    get_response_etag,
+)
+from movie.watchlist import aget_cached_watchlist, ainvalidate_cached_watchlists
+from utility.serializers import ValuesRepresentation
+from utility.views import AsyncAPIView, SparseFieldsetMixin, get_values_lookups
+
+
+class WatchlistContextMixin:
+    async def get_serializer_context(self):
+        context = {
+            "request": self.request,
+            "format": self.format_kwarg,
+            "view": self,
+            "fields": self.sparse_fields,
+        }
+        if self.is_field_requested("is_in_watchlist"):
+            context["watchlist"] = await aget_cached_watchlist(self.request.user)
+        return context
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Async counterpart of `views.AnonymousResponseCacheMixin`, views implement `respond()` instead of `get()`.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return await self.respond(request, *args, **kwargs)
+        version = await aget_catalogue_version()
+        etag = get_response_etag(version, request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = get_response_cache_key(version, request)
+            data = await cache.aget(cache_key)
+            if data is None:
+                response = await self.respond(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                await cache.aset(cache_key, response.data, RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        elif response.status_code != status.HTTP_304_NOT_MODIFIED:
+            return response
+        return views.patch_response_cache_headers(response, etag)
+
+
+class ListMovieAPIView(AnonymousResponseCacheMixin, WatchlistContextMixin, SparseFieldsetMixin, AsyncAPIView):
+    serializer_class = views.ListMovieAPIView.serializer_class
+    pagination_class = views.ListMovieAPIView.pagination_class
+    filter_backends = views.ListMovieAPIView.filter_backends
+
+    async def respond(self, request, *args, **kwargs):
+        paginator = self.pagination_class()
+        queryset = self.trim_queryset(Movie.objects.all(), paginator.get_ordering(request).lstrip("-"))
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        serializer = self.serializer_class(many=True, context=await self.get_serializer_context())
+        if not settings.FAST_LIST_SERIALIZATION:
+            serializer.instance = await paginator.apaginate_queryset(queryset, request, self)
+            return paginator.get_paginated_response(serializer.data)
+        representation = ValuesRepresentation(serializer.child)
+        lookups = get_values_lookups(representation, paginator, request)
+        page = await paginator.apaginate_queryset(queryset.values(*lookups), request, self)
+        return paginator.get_paginated_response([representation.to_representation(row) for row in page])
+
+
+class RetrieveMovieAPIView(AnonymousResponseCacheMixin, WatchlistContextMixin, SparseFieldsetMixin, AsyncAPIView):
+    serializer_class = views.RetrieveMovieAPIView.serializer_class
+    field_columns = views.RetrieveMovieAPIView.field_columns
+
+    async def respond(self, request, pk, *args, **kwargs):
+        queryset = views.RetrieveMovieAPIView.get_queryset(self)
+        try:
+            movie = await queryset.aget(pk=pk)
+        except Movie.DoesNotExist:
+            raise Http404
+        if self.is_field_requested("ratings"):
+            ratings = MovieRating.objects.newest(movie.id, views.LATEST_RATINGS_COUNT)
+            movie.latest_ratings = [rating async for rating in ratings]
+        serializer = self.serializer_class(movie, context=await self.get_serializer_context())
+        return Response(serializer.data)
+
+
+class AddRemoveMovieToWatchList(AsyncAPIView):
+    # Rows are written to the through table directly, since related managers have no async methods yet.
+    # That skips `m2m_changed`, so the cached watchlist is invalidated here.
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request, pk, *args, **kwargs):
+        movie_list = await self.get_watchlist(request, pk)
+        await MovieList.movies.through.objects.aget_or_create(movielist=movie_list, movie_id=pk)
+        await ainvalidate_cached_watchlists([request.user.id])
+        return Response(status=status.HTTP_201_CREATED)
+
+    async def delete(self, request, pk, *args, **kwargs):
+        movie_list = await self.get_watchlist(request, pk)
+        await MovieList.movies.through.objects.filter(movielist=movie_list, movie_id=pk).adelete()
+        await ainvalidate_cached_watchlists([request.user.id])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    async def get_watchlist(self, request, pk):
+        movie_list, _ = await MovieList.objects.aget_or_create(user=request.user, name=MovieList.WATCH_LIST_NAME)
+        if not await Movie.objects.filter(pk=pk).aexists():
+            raise Http404
+        return movie_list
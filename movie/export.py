@@ -0,0 +1,74 @@
+import csv
+import datetime
+import itertools
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from movie.models import Movie, MovieRating
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Exported columns of every dataset, mapped to the lookups they are read from.
+EXPORTS = {
+    "ratings": (MovieRating, {
+        "id": "id",
+        "user_id": "user_id",
+        "username": "user__username",
+        "movie_id": "movie_id",
+        "rating": "rating",
+        "comment": "comment",
+        "created_at": "created_at",
+    }),
+    "movies": (Movie, {
+        "id": "id",
+        "name": "name",
+        "director": "director",
+        "created_year": "created_year",
+        "length_minutes": "length_minutes",
+        "imdb_rating": "imdb_rating",
+        "rating_count": "rating_count",
+        "overall_rating": "overall_rating",
+        "source_url": "source_url",
+    }),
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def iter_rows(dataset):
+    model, columns = EXPORTS[dataset]
+    queryset = model.objects.order_by("id").values_list(*columns.values())
+    # Chunked iteration uses a server-side cursor where the database has one, so only a chunk of rows is
+    # held in memory at a time.
+    return queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iter_export(dataset, export_format):
+    """
+    Yield the rows of `dataset` encoded as `export_format`, in text chunks of up to EXPORT_CHUNK_SIZE rows.
+    """
+    columns = list(EXPORTS[dataset][1])
+    rows = iter_rows(dataset)
+    if export_format == "csv":
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+
+        def encode(row):
+            return writer.writerow(
+                value.isoformat() if isinstance(value, datetime.datetime) else value for value in row
+            )
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+        def encode(row):
+            return encoder.encode(dict(zip(columns, row))) + "\n"
+    while chunk := list(itertools.islice(rows, EXPORT_CHUNK_SIZE)):
+        yield "".join(map(encode, chunk))
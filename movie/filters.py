@@ -0,0 +1,84 @@
+from rest_framework import serializers
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.filters import BaseFilterBackend
+
+
+class MovieFilterSerializer(serializers.Serializer):
+    director = serializers.CharField(required=False)
+    created_year_min = serializers.IntegerField(required=False)
+    created_year_max = serializers.IntegerField(required=False)
+    length_minutes_min = serializers.IntegerField(required=False, min_value=0)
+    length_minutes_max = serializers.IntegerField(required=False, min_value=0)
+    imdb_rating_min = serializers.FloatField(required=False)
+    overall_rating_min = serializers.FloatField(required=False, min_value=1, max_value=5)
+
+    lookups = {
+        "director": "director",
+        "created_year_min": "created_year__gte",
+        "created_year_max": "created_year__lte",
+        "length_minutes_min": "length_minutes__gte",
+        "length_minutes_max": "length_minutes__lte",
+        "imdb_rating_min": "imdb_rating__gte",
+        "overall_rating_min": "overall_rating__gte",
+    }
+
+    def get_filters(self):
+        return {self.lookups[name]: value for name, value in self.validated_data.items()}
+
+
+class TopMovieFilterSerializer(serializers.Serializer):
+    year = serializers.IntegerField(required=False)
+
+    lookups = {
+        "year": "created_year",
+    }
+
+    def get_filters(self):
+        return {self.lookups[name]: value for name, value in self.validated_data.items()}
+
+
+class MovieFilterBackend(BaseFilterBackend):
+    filter_serializer_class = MovieFilterSerializer
+
+    def filter_queryset(self, request, queryset, view):
+        serializer = self.filter_serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return queryset.filter(**serializer.get_filters())
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, "coreapi must be installed to use `get_schema_fields()`"
+        assert coreschema is not None, "coreschema must be installed to use `get_schema_fields()`"
+        schema_types = {
+            serializers.CharField: coreschema.String,
+            serializers.IntegerField: coreschema.Integer,
+            serializers.FloatField: coreschema.Number,
+        }
+        return [
+            coreapi.Field(
+                name=name,
+                required=False,
+                location="query",
+                schema=schema_types[type(field)](title=name.replace("_", " ").capitalize()),
+            )
+            for name, field in self.filter_serializer_class().fields.items()
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        schema_types = {
+            serializers.CharField: "string",
+            serializers.IntegerField: "integer",
+            serializers.FloatField: "number",
+        }
+        return [
+            {
+                "name": name,
+                "required": False,
+                "in": "query",
+                "schema": {"type": schema_types[type(field)]},
+            }
+            for name, field in self.filter_serializer_class().fields.items()
+        ]
+
+
+class TopMovieFilterBackend(MovieFilterBackend):
+    filter_serializer_class = TopMovieFilterSerializer
@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_WIDTHS = {
+    "logo": [92, 185, 342],
+    "header_image": [780, 1280],
+}
+IMAGE_VARIANT_FORMATS = [
+    ("jpeg", "JPEG", "jpg"),
+    ("webp", "WEBP", "webp"),
+]
+IMAGE_VARIANT_QUALITY = 80
+
+
+def get_stale_image_fields(movie):
+    return [
+        field_name
+        for field_name in IMAGE_VARIANT_WIDTHS
+        if getattr(movie, field_name).name != movie.image_variants.get(field_name, {}).get("source", "")
+    ]
+
+
+def generate_image_variants(movie, field_names=None):
+    """
+    Build resized JPEG and WebP copies of the movie's images next to the originals and return the updated
+    `image_variants` value. Variant file names contain a hash of their content, so they never change once
+    written and are served as immutable.
+    """
+    image_variants = dict(movie.image_variants)
+    for field_name in field_names or IMAGE_VARIANT_WIDTHS:
+        field_file = getattr(movie, field_name)
+        old_names = {variant["name"] for variant in image_variants.pop(field_name, {}).get("variants", [])}
+        if not field_file:
+            delete_files(field_file.storage, old_names)
+            continue
+        try:
+            with field_file.open("rb"):
+                image = Image.open(field_file)
+                image.load()
+        except (OSError, UnidentifiedImageError):
+            logger.warning("Could not read %s of movie %s, skipping its variants.", field_name, movie.pk)
+            continue
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        stem = os.path.splitext(field_file.name)[0]
+        variants = []
+        for width in sorted({min(width, image.width) for width in IMAGE_VARIANT_WIDTHS[field_name]}):
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for format_name, pil_format, extension in IMAGE_VARIANT_FORMATS:
+                output = BytesIO()
+                resized.save(output, pil_format, quality=IMAGE_VARIANT_QUALITY)
+                content = output.getvalue()
+                name = f"{stem}.{width}w.{hashlib.sha256(content).hexdigest()[:16]}.{extension}"
+                if not field_file.storage.exists(name):
+                    name = field_file.storage.save(name, ContentFile(content))
+                variants.append({"name": name, "width": width, "height": height, "format": format_name})
+        image_variants[field_name] = {"source": field_file.name, "variants": variants}
+        delete_files(field_file.storage, old_names - {variant["name"] for variant in variants})
+    return image_variants
+
+
+def delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
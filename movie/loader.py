@@ -0,0 +1,209 @@
+import csv
+import itertools
+import json
+import re
+import time
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from movie.models import Movie, MovieList, MovieRanking, MovieRating
+from movie.response_cache import invalidate_catalogue
+from movie.watchlist import invalidate_cached_watchlists
+
+LOAD_BATCH_SIZE = 5000
+
+# Column names of MovieLens and of the export_data command, mapped to the loader's names.
+COLUMN_ALIASES = {
+    "movieId": "movie_id",
+    "userId": "user_id",
+    "title": "name",
+}
+MOVIELENS_TITLE = re.compile(r"^(?P<name>.*?)\s*\((?P<year>\d{4})\)\s*$")
+
+
+def read_rows(path, input_format=None):
+    """
+    Yield the rows of a CSV file with a header line, or of a file of JSON objects one per line, as dicts.
+    """
+    input_format = input_format or Path(path).suffix.lstrip(".").lower()
+    with open(path, newline="", encoding="utf-8") as input_file:
+        if input_format == "csv":
+            rows = csv.DictReader(input_file)
+        elif input_format in ("jsonl", "json", "ndjson"):
+            rows = (json.loads(line) for line in input_file if line.strip())
+        else:
+            raise ValueError(f"Unknown format of {path}, expected csv or jsonl.")
+        for row in rows:
+            yield {COLUMN_ALIASES.get(column, column): value for column, value in row.items()}
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+class DatasetLoader:
+    """
+    Loads movies, users, ratings and watchlists with batched `bulk_create` calls, skipping rows that already
+    exist. Signals do not run for bulk inserts, so `finish()` rebuilds the stored aggregates afterwards.
+
+    Movies keep the ids of the input, which ratings and watchlists refer to, and input movies whose id belongs
+    to a different movie are refused. Users are matched by username; rows that only carry a numeric user id,
+    like MovieLens, belong to the user `<username_prefix><id>`. Missing users are created without a usable
+    password.
+    """
+
+    def __init__(self, batch_size=LOAD_BATCH_SIZE, username_prefix="user-"):
+        self.batch_size = batch_size
+        self.username_prefix = username_prefix
+        self.user_ids = {}
+        self.movie_ids = None
+        self.loaded_movies = False
+        self.loaded_ratings = False
+        self.watchlist_user_ids = set()
+
+    def load(self, rows, load_batch):
+        """
+        Feed `rows` to `load_batch` in batches and return the number of rows read, the number written and the
+        rows per second.
+        """
+        started = time.perf_counter()
+        read = written = 0
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                written += load_batch(batch)
+            read += len(batch)
+        elapsed = time.perf_counter() - started
+        return read, written, read / elapsed if elapsed else 0
+
+    def load_movies(self, rows):
+        return self.load(rows, self.load_movie_batch)
+
+    def load_users(self, rows):
+        return self.load(rows, self.load_user_batch)
+
+    def load_ratings(self, rows):
+        self.loaded_ratings = True
+        return self.load(rows, self.load_rating_batch)
+
+    def load_watchlists(self, rows):
+        return self.load(rows, self.load_watchlist_batch)
+
+    def load_movie_batch(self, rows):
+        movies = []
+        for row in rows:
+            name, created_year = row.get("name", ""), row.get("created_year")
+            match = MOVIELENS_TITLE.match(name)
+            if match and created_year is None:
+                name, created_year = match["name"], match["year"]
+            movies.append(Movie(
+                id=int(row.get("movie_id", row.get("id"))),
+                name=name[:Movie._meta.get_field("name").max_length],
+                director=row.get("director") or "",
+                created_year=int(created_year or 0),
+                length_minutes=int(row.get("length_minutes") or 0),
+                imdb_rating=float(row.get("imdb_rating") or 0),
+                logo=row.get("logo") or "",
+                header_image=row.get("header_image") or "",
+                story=row.get("story") or "",
+                source_url=row.get("source_url") or None,
+            ))
+        # Ratings and watchlists refer to the input ids, so an id that belongs to another movie must not be
+        # skipped like a movie that is loaded again.
+        stored = Movie.objects.filter(id__in=[movie.id for movie in movies]).values_list("id", "name", "created_year")
+        existing = {movie_id: (name, created_year) for movie_id, name, created_year in stored}
+        conflicts = sorted(
+            movie.id for movie in movies
+            if movie.id in existing and existing[movie.id] != (movie.name, movie.created_year)
+        )
+        if conflicts:
+            raise ValueError(f"Movie ids already used by other movies: {', '.join(map(str, conflicts[:10]))}")
+        Movie.objects.bulk_create([movie for movie in movies if movie.id not in existing], ignore_conflicts=True)
+        self.movie_ids = None
+        self.loaded_movies = True
+        return len(movies) - len(existing)
+
+    def load_user_batch(self, rows):
+        return len(self.get_user_ids(rows))
+
+    def load_rating_batch(self, rows):
+        user_ids, movie_ids = self.get_user_ids(rows), self.get_movie_ids()
+        ratings = [
+            MovieRating(
+                user_id=user_id,
+                movie_id=int(row["movie_id"]),
+                # MovieLens has half stars from 0.5 to 5, they are rounded half up onto 1 to 5.
+                rating=max(1, min(5, int(float(row["rating"]) + 0.5))),
+                comment=row.get("comment") or "",
+            )
+            for row, user_id in zip(rows, user_ids)
+            if int(row["movie_id"]) in movie_ids
+        ]
+        MovieRating.objects.bulk_create(ratings, ignore_conflicts=True)
+        return len(ratings)
+
+    def load_watchlist_batch(self, rows):
+        user_ids, movie_ids = self.get_user_ids(rows), self.get_movie_ids()
+        MovieList.objects.bulk_create(
+            (MovieList(user_id=user_id, name=MovieList.WATCH_LIST_NAME) for user_id in set(user_ids)),
+            ignore_conflicts=True,
+        )
+        watchlist_ids = dict(
+            MovieList.objects.filter(user_id__in=set(user_ids), name=MovieList.WATCH_LIST_NAME).values_list(
+                "user_id", "id",
+            ),
+        )
+        through = [
+            MovieList.movies.through(movielist_id=watchlist_ids[user_id], movie_id=int(row["movie_id"]))
+            for row, user_id in zip(rows, user_ids)
+            if int(row["movie_id"]) in movie_ids
+        ]
+        MovieList.movies.through.objects.bulk_create(through, ignore_conflicts=True)
+        self.watchlist_user_ids.update(user_ids)
+        return len(through)
+
+    def get_movie_ids(self):
+        if self.movie_ids is None:
+            self.movie_ids = set(Movie.objects.values_list("id", flat=True).iterator())
+        return self.movie_ids
+
+    def get_user_ids(self, rows):
+        """
+        Return the ids of the users of `rows`, creating the users that do not exist yet.
+        """
+        usernames = [
+            row.get("username") or f"{self.username_prefix}{int(row['user_id'])}"
+            for row in rows
+        ]
+        missing = {username for username in usernames if username not in self.user_ids}
+        if missing:
+            password = make_password(None)
+            User.objects.bulk_create(
+                (User(username=username, password=password) for username in missing),
+                ignore_conflicts=True,
+            )
+            for chunk in batched(missing, 500):
+                self.user_ids.update(User.objects.filter(username__in=chunk).values_list("username", "id"))
+        return [self.user_ids[username] for username in usernames]
+
+    def finish(self):
+        """
+        Rebuild what the signals would have maintained row by row.
+        """
+        with transaction.atomic():
+            if self.loaded_movies:
+                # Movies were inserted with explicit ids, which do not advance the id sequence of PostgreSQL.
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [Movie]):
+                        cursor.execute(sql)
+            if self.loaded_ratings:
+                Movie.objects.rebuild_rating_stats()
+                Movie.objects.update(similar_movies_stale=True)
+            MovieRanking.objects.rebuild()
+        invalidate_cached_watchlists(self.watchlist_user_ids)
+        invalidate_catalogue()
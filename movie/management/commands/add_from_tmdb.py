@@ -1,44 +1,114 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
 
 import cssutils
 import requests
 from bs4 import BeautifulSoup
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.management import BaseCommand
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from requests.adapters import HTTPAdapter
 
 from movie.models import Movie
 
 
 class Command(BaseCommand):
+    help = "Import movies from TMDB movie pages, either a single URL or many URLs listed in a file."
+
     def add_arguments(self, parser):
         parser.add_argument(
             "url",
+            nargs="?",
+        )
+        parser.add_argument(
+            "--file",
+            help="Read the movie page URLs to import from this file, one per line.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of pages and images fetched in parallel.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Number of movies written per transaction.",
         )
 
     def handle(self, *args, **options):
-        url = options["url"]
-        response = requests.get(
-            url, headers={
-                "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/113.0",
-            }
-        )
-        html = response.text
-        soup = BeautifulSoup(html, "html.parser")
-        name, release_date = self.get_name_and_release_date(soup)
-        header_image = self.get_header_image(soup)
-        logo_image = self.get_logo_image(soup)
-        overview = self.get_overview(soup)
-        director = self.get_director(soup)
-        Movie.objects.create(
-            name=name.strip(),
-            director=director.strip(),
-            created_year=release_date.strip(),
-            length_minutes=self.get_length_minutes(soup),
-            imdb_rating=self.get_rating(soup),
-            logo=SimpleUploadedFile("img.jpg", logo_image),
-            header_image=SimpleUploadedFile("header.jpg", header_image),
-            story=overview.strip(),
+        if options["file"]:
+            with open(options["file"]) as file:
+                urls = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+        elif options["url"]:
+            urls = [options["url"]]
+        else:
+            raise CommandError("Either a url or --file must be given.")
+
+        # Movies are committed in batches, so an interrupted import resumes from the first unsaved movie.
+        imported = set(Movie.objects.filter(source_url__in=urls).values_list("source_url", flat=True))
+        urls = list(dict.fromkeys(url for url in urls if url not in imported))
+        workers = max(1, options["workers"])
+        batch_size = max(1, options["batch_size"])
+
+        self.session = self.make_session(workers)
+        created, failed = 0, 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(urls), batch_size):
+                batch = urls[start:start + batch_size]
+                movies = []
+                for url, result in zip(batch, executor.map(self.fetch_movie, batch)):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        self.stderr.write(f"Failed to import {url}: {result!r}")
+                    else:
+                        movies.append(result)
+                self.save_movies(movies)
+                created += len(movies)
+                self.stdout.write(f"Imported {created} of {len(urls)} movies.")
+        self.stdout.write(f"Done: {created} imported, {len(imported)} already imported, {failed} failed.")
+        if failed:
+            raise CommandError(f"{failed} movies failed to import, run the command again to retry them.")
+
+    def make_session(self, workers):
+        session = requests.Session()
+        session.headers["User-Agent"] = (
+            "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/113.0"
         )
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def fetch_movie(self, url):
+        try:
+            response = self.session.get(url)
+            response.raise_for_status()
+            soup = BeautifulSoup(response.text, "html.parser")
+            name, release_date = self.get_name_and_release_date(soup)
+            return {
+                "source_url": url,
+                "name": name.strip(),
+                "director": self.get_director(soup).strip(),
+                "created_year": release_date.strip(),
+                "length_minutes": self.get_length_minutes(soup),
+                "imdb_rating": self.get_rating(soup),
+                "logo": self.get_logo_image(soup, url),
+                "header_image": self.get_header_image(soup, url),
+                "story": self.get_overview(soup).strip(),
+            }
+        except Exception as e:
+            return e
+
+    def save_movies(self, movies):
+        with transaction.atomic():
+            for data in movies:
+                movie = Movie(**{key: value for key, value in data.items() if key not in ("logo", "header_image")})
+                movie.logo.save("img.jpg", ContentFile(data["logo"]), save=False)
+                movie.header_image.save("header.jpg", ContentFile(data["header_image"]), save=False)
+                movie.save()
 
     def get_name_and_release_date(self, soup: BeautifulSoup):
         release_date_span = soup.find("span", class_="release_date")
@@ -46,17 +116,17 @@ class Command(BaseCommand):
         name = release_date_span.previous_sibling.previous_sibling.text
         return name, release_date
 
-    def get_header_image(self, soup: BeautifulSoup):
-        rules = cssutils.CSSParser().parseString(soup.find("style").prettify()).cssRules
+    def get_header_image(self, soup: BeautifulSoup, page_url):
+        rules = cssutils.CSSParser().parseString(soup.find("style").get_text()).cssRules
         for rule in rules:
             if hasattr(rule, "selectorText") and rule.selectorText == "div.header.large.first":
-                url = "https://www.themoviedb.org" + rule.style.backgroundImage.split("(", 1)[1].rstrip(")")
+                url = urljoin(page_url, rule.style.backgroundImage.split("(", 1)[1].rstrip(")"))
                 return self.download_image(url)
         raise Exception
 
-    def get_logo_image(self, soup: BeautifulSoup):
+    def get_logo_image(self, soup: BeautifulSoup, page_url):
         url = soup.find("img", class_="poster").get_attribute_list("data-src")[0]
-        url = "https://www.themoviedb.org" + url
+        url = urljoin(page_url, url)
         return self.download_image(url)
 
     def get_overview(self, soup: BeautifulSoup):
@@ -77,9 +147,6 @@ class Command(BaseCommand):
         return int(soup.find("div", class_="percent").find("span").attrs["class"][-1].split("-")[-1][1:])
 
     def download_image(self, url):
-        response = requests.get(
-            url, headers={
-                "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/113.0",
-            }
-        )
+        response = self.session.get(url)
+        response.raise_for_status()
         return response.content
@@ -0,0 +1,442 @@
+import asyncio
+import importlib
+import json
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from pathlib import Path
+
+import requests
+import uvicorn
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import clear_url_caches
+from requests.adapters import HTTPAdapter
+from rest_framework.authtoken.models import Token
+
+from movie.models import Movie, MovieList, MovieRanking, MovieRating
+from user.models import SecurityQuestion
+from utility.cache import version_cache
+
+PASSWORD = "benchmark-Passw0rd"
+QUERY_COUNT_HEADER = "X-Benchmark-Queries"
+
+# Caches of the benchmark process, so that it neither serves nor invalidates the entries of the real server.
+BENCHMARK_CACHES = {
+    alias: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": f"benchmark-{alias}",
+        "OPTIONS": {"MAX_ENTRIES": settings.CACHE_MAX_ENTRIES},
+    }
+    for alias in ["default", "versions"]
+}
+
+# Relative weight of every endpoint in the mixed workload.
+WORKLOAD = {
+    "movie:list": 30,
+    "movie:list_filtered": 10,
+    "movie:retrieve": 25,
+    "movie:top": 5,
+    "movie:ratings": 5,
+    "movie:retrieve_watchlist": 8,
+    "movie:create_rating": 10,
+    "movie:add_to_watchlist": 10,
+    "user:login": 4,
+    "user:register": 3,
+}
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Queries are counted per request through a context variable, which asgiref copies into the threads that
+# run the ORM for async views.
+request_queries = ContextVar("request_queries", default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class QueryCountingApplication:
+    """
+    Wraps the WSGI application and reports the number of SQL queries of every request in a response header.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        counter = [0]
+        started = []
+
+        def delayed_start_response(status, headers, exc_info=None):
+            started.append((status, headers))
+
+        # The body is rendered before the headers are sent, so that queries run by lazy responses are counted.
+        token = request_queries.set(counter)
+        try:
+            response = self.application(environ, delayed_start_response)
+            try:
+                content = b"".join(response)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+        finally:
+            request_queries.reset(token)
+        status, headers = started[0]
+        start_response(status, headers + [(QUERY_COUNT_HEADER, str(counter[0]))])
+        return [content]
+
+
+class QueryCountingASGIApplication:
+    """
+    ASGI version of `QueryCountingApplication`. Django runs the whole view before it starts the response.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        counter = [0]
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                header = (QUERY_COUNT_HEADER.lower().encode(), str(counter[0]).encode())
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        token = request_queries.set(counter)
+        try:
+            await self.application(scope, receive, counting_send)
+        finally:
+            request_queries.reset(token)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with a synthetic dataset, serve the API locally and drive a mixed workload "
+        "against it. Prints latency percentiles, throughput and SQL query counts per endpoint as JSON. "
+        "Compare the sync and async modes by passing the report of a --server wsgi run as the --baseline of "
+        "a --server asgi run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=1000)
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--ratings", type=int, default=20000)
+        parser.add_argument("--watchlist-size", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=2000, help="Total number of requests to send.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the dataset and workload.")
+        parser.add_argument(
+            "--server",
+            choices=["wsgi", "asgi"],
+            default="wsgi",
+            help="Serve the API with threaded WSGI and sync views, or with uvicorn and the async views.",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument("--baseline", help="Compare the results with a report saved by an earlier run.")
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=None,
+            help="Fail when the p95 latency of an endpoint is this fraction above the baseline, e.g. 0.2.",
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        settings.DEBUG = False
+        settings.ASYNC_VIEWS = options["server"] == "asgi"
+        self.reload_urls()
+        # All clients share one address, the workload measures capacity rather than the auth throttles.
+        settings.AUTH_THROTTLE_RATES = {}
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=BENCHMARK_CACHES):
+            cache.clear()
+            version_cache.clear()
+            connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "benchmark.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.stderr.write("Seeding the dataset...")
+                self.seed(options)
+                report = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                report["baseline_comparison"] = self.compare(report, json.load(file))
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        regressions = [
+            name for name, comparison in report.get("baseline_comparison", {}).items()
+            if options["max_regression"] is not None and comparison["p95_change"] > options["max_regression"]
+        ]
+        if regressions:
+            raise CommandError(f"p95 latency regressed on: {', '.join(regressions)}")
+
+    def reload_urls(self):
+        """
+        Reload the URL configuration, which the system checks loaded before --server picked the views it
+        routes the hot endpoints to.
+        """
+        for module in ["movie.urls", settings.ROOT_URLCONF]:
+            importlib.reload(importlib.import_module(module))
+        clear_url_caches()
+
+    def seed(self, options):
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            User(username=f"bench-user-{i}", password=password) for i in range(options["users"])
+        )
+        SecurityQuestion.objects.bulk_create(
+            SecurityQuestion(user=user, question="question", answer="answer") for user in users
+        )
+        tokens = Token.objects.bulk_create(Token(user=user, key=Token.generate_key()) for user in users)
+        movies = Movie.objects.bulk_create(
+            Movie(
+                name=f"Movie {i}",
+                director=f"Director {i % 50}",
+                created_year=self.random.randint(1950, 2023),
+                length_minutes=self.random.randint(70, 200),
+                imdb_rating=round(self.random.uniform(10, 95)),
+                logo=f"bench/logo-{i}.jpg",
+                header_image=f"bench/header-{i}.jpg",
+                story="Story. " * 20,
+            )
+            for i in range(options["movies"])
+        )
+        self.movie_ids = [movie.id for movie in movies]
+        self.users = [(user.username, token.key) for user, token in zip(users, tokens)]
+
+        ratings = self.random.sample(
+            range(len(users) * len(movies)),
+            min(options["ratings"], len(users) * len(movies)),
+        )
+        self.rated = {(users[i // len(movies)].username, movies[i % len(movies)].id) for i in ratings}
+        MovieRating.objects.bulk_create(
+            (
+                MovieRating(
+                    user=users[i // len(movies)],
+                    movie=movies[i % len(movies)],
+                    rating=self.random.randint(1, 5),
+                )
+                for i in ratings
+            ),
+            batch_size=1000,
+        )
+        Movie.objects.rebuild_rating_stats()
+        MovieRanking.objects.rebuild()
+
+        watchlists = MovieList.objects.bulk_create(
+            MovieList(user=user, name=MovieList.WATCH_LIST_NAME) for user in users
+        )
+        self.watchlisted = set()
+        through = []
+        for watchlist, user in zip(watchlists, users):
+            for movie_id in self.random.sample(self.movie_ids, min(options["watchlist_size"], len(movies))):
+                self.watchlisted.add((user.username, movie_id))
+                through.append(MovieList.movies.through(movielist_id=watchlist.id, movie_id=movie_id))
+        MovieList.movies.through.objects.bulk_create(through, batch_size=1000)
+        connection.close()
+
+    def run(self, options):
+        connection_created.connect(install_query_counter)
+        if options["server"] == "asgi":
+            stop_server = self.start_asgi_server()
+        else:
+            stop_server = self.start_wsgi_server()
+        self.lock = threading.Lock()
+        self.registered = 0
+
+        endpoints = list(WORKLOAD)
+        plan = self.random.choices(endpoints, weights=[WORKLOAD[name] for name in endpoints], k=options["requests"])
+        samples = defaultdict(list)
+        sessions = threading.local()
+
+        def send(endpoint):
+            if not hasattr(sessions, "session"):
+                sessions.session = requests.Session()
+                sessions.session.mount("http://", HTTPAdapter(pool_maxsize=1))
+            method, path, kwargs = self.make_request(endpoint)
+            started = time.perf_counter()
+            response = sessions.session.request(method, self.base_url + path, **kwargs)
+            elapsed = time.perf_counter() - started
+            return endpoint, elapsed, response.status_code, int(response.headers.get(QUERY_COUNT_HEADER, 0))
+
+        self.stderr.write(f"Sending {len(plan)} requests with {options['concurrency']} clients...")
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                for endpoint, elapsed, status_code, queries in executor.map(send, plan):
+                    samples[endpoint].append((elapsed, status_code, queries))
+        finally:
+            stop_server()
+            connection_created.disconnect(install_query_counter)
+        duration = time.perf_counter() - started
+
+        return {
+            "config": {
+                key: options[key]
+                for key in [
+                    "movies", "users", "ratings", "watchlist_size", "requests", "concurrency", "seed", "server",
+                ]
+            },
+            "duration_seconds": round(duration, 3),
+            "throughput_rps": round(len(plan) / duration, 2),
+            "endpoints": {
+                endpoint: self.summarize(samples[endpoint], duration) for endpoint in endpoints if samples[endpoint]
+            },
+        }
+
+    def start_wsgi_server(self):
+        server = ThreadedWSGIServer(("127.0.0.1", 0), QuietWSGIRequestHandler, allow_reuse_address=True)
+        server.set_app(QueryCountingApplication(get_wsgi_application()))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{server.server_port}"
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return stop
+
+    def start_asgi_server(self):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        config = uvicorn.Config(
+            QueryCountingASGIApplication(get_asgi_application()),
+            lifespan="off",
+            log_level="warning",
+            access_log=False,
+        )
+        server = uvicorn.Server(config)
+        thread = threading.Thread(target=lambda: asyncio.run(server.serve(sockets=[sock])), daemon=True)
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                raise CommandError("The ASGI server failed to start.")
+            time.sleep(0.01)
+        self.base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+            sock.close()
+        return stop
+
+    def make_request(self, endpoint):
+        username, token = self.random.choice(self.users)
+        auth = {"headers": {"Authorization": f"Token {token}"}}
+        movie_id = self.random.choice(self.movie_ids)
+        if endpoint == "movie:list":
+            return "GET", "/movie/", self.random.choice([{}, auth])
+        if endpoint == "movie:list_filtered":
+            params = {
+                "created_year_min": self.random.randint(1950, 2000),
+                "ordering": self.random.choice(["-imdb_rating", "-overall_rating", "created_year"]),
+            }
+            return "GET", "/movie/", {"params": params, **auth}
+        if endpoint == "movie:retrieve":
+            return "GET", f"/movie/{movie_id}/", self.random.choice([{}, auth])
+        if endpoint == "movie:top":
+            params = self.random.choice([{}, {"year": self.random.randint(1950, 2023)}])
+            return "GET", "/movie/top/", {"params": params, **self.random.choice([{}, auth])}
+        if endpoint == "movie:ratings":
+            return "GET", f"/movie/{movie_id}/ratings/", self.random.choice([{}, auth])
+        if endpoint == "movie:retrieve_watchlist":
+            return "GET", "/movie/watchlist/", auth
+        if endpoint == "movie:create_rating":
+            with self.lock:
+                for _ in range(10):
+                    if (username, movie_id) not in self.rated:
+                        break
+                    movie_id = self.random.choice(self.movie_ids)
+                self.rated.add((username, movie_id))
+            data = {"rating": self.random.randint(1, 5), "comment": "benchmark"}
+            return "POST", f"/movie/{movie_id}/rating/", {"json": data, **auth}
+        if endpoint == "movie:add_to_watchlist":
+            with self.lock:
+                method = "DELETE" if (username, movie_id) in self.watchlisted else "POST"
+                self.watchlisted.symmetric_difference_update({(username, movie_id)})
+            return method, f"/movie/{movie_id}/watchlist/", auth
+        if endpoint == "user:login":
+            return "POST", "/user/login/", {"json": {"username": username, "password": PASSWORD}}
+        if endpoint == "user:register":
+            with self.lock:
+                self.registered += 1
+                username = f"bench-new-user-{self.registered}"
+            data = {
+                "username": username,
+                "password": PASSWORD,
+                "security_question": {"question": "question", "answer": "answer"},
+            }
+            return "POST", "/user/register/", {"json": data}
+        raise ValueError(endpoint)
+
+    def summarize(self, samples, duration):
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+        queries = [count for _, _, count in samples]
+        return {
+            "requests": len(samples),
+            "errors": sum(1 for _, status_code, _ in samples if status_code >= 400),
+            "throughput_rps": round(len(samples) / duration, 2),
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 3),
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "max": round(latencies[-1], 3),
+            },
+            "queries": {
+                "mean": round(sum(queries) / len(queries), 2),
+                "max": max(queries),
+            },
+        }
+
+    def compare(self, report, baseline):
+        comparison = {}
+        for endpoint, result in report["endpoints"].items():
+            previous = baseline.get("endpoints", {}).get(endpoint)
+            if previous is None:
+                continue
+            comparison[endpoint] = {
+                "p95_change": round(result["latency_ms"]["p95"] / previous["latency_ms"]["p95"] - 1, 3),
+                "throughput_change": round(result["throughput_rps"] / previous["throughput_rps"] - 1, 3),
+                "queries_change": round(result["queries"]["mean"] - previous["queries"]["mean"], 2),
+            }
+        return comparison
+
+
+def percentile(sorted_values, percent):
+    index = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
@@ -0,0 +1,236 @@
+import re
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import get_resolver, reverse
+from rest_framework.authtoken.models import Token
+
+from movie.models import Movie, MovieList, MovieRanking, MovieRating, SimilarMovie
+from user.models import SecurityQuestion
+from utility.cache import version_cache
+
+PASSWORD = "explain-Passw0rd"
+
+# Cached responses would skip the queries to explain, and the requests must not invalidate the entries of the
+# real server.
+EXPLAIN_CACHES = {
+    alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": f"explain-{alias}"}
+    for alias in ["default", "versions"]
+}
+
+# Requests sent to every endpoint, as (method, URL kwargs, query parameters or body, authenticated). Every
+# named URL of the apps must be listed here or in SKIPPED_ENDPOINTS. user:logout runs last because it
+# deletes the token.
+ENDPOINT_REQUESTS = {
+    "movie:list": [
+        ("get", {}, {"page_size": 5}, False),
+        ("get", {}, {"page_size": 5, "director": "Director 1"}, True),
+        ("get", {}, {"page_size": 5, "created_year_min": 2000, "ordering": "-imdb_rating"}, True),
+        ("get", {}, {"page_size": 5, "overall_rating_min": 3, "ordering": "-overall_rating"}, False),
+    ],
+    "movie:top": [
+        ("get", {}, {"page_size": 5}, False),
+        ("get", {}, {"page_size": 5, "year": 2001}, True),
+    ],
+    "movie:retrieve": [
+        ("get", {"pk": 1}, {}, False),
+        ("get", {"pk": 1}, {}, True),
+    ],
+    "movie:ratings": [("get", {"pk": 1}, {"page_size": 2}, False)],
+    "movie:similar": [("get", {"pk": 1}, {}, True)],
+    "movie:create_rating": [("post", {"pk": 2}, {"rating": 4, "comment": "explain"}, True)],
+    "movie:add_to_watchlist": [
+        ("post", {"pk": 3}, {}, True),
+        ("delete", {"pk": 3}, {}, True),
+    ],
+    "movie:retrieve_watchlist": [("get", {}, {"page_size": 2}, True)],
+    "movie:bulk_update_watchlist": [("post", {}, {"add": [4, 5], "remove": [1]}, True)],
+    "movie:lists": [
+        ("get", {}, {}, True),
+        ("post", {}, {"name": "Favourites"}, True),
+    ],
+    "movie:list_detail": [
+        ("get", {"list_id": 2}, {}, True),
+        ("patch", {"list_id": 2}, {"name": "Best"}, True),
+        ("delete", {"list_id": 3}, {}, True),
+    ],
+    "movie:list_movies": [("get", {"list_id": 2}, {"page_size": 2}, True)],
+    "movie:list_movie": [
+        ("post", {"list_id": 2, "pk": 7}, {}, True),
+        ("delete", {"list_id": 2, "pk": 7}, {}, True),
+    ],
+    "movie:list_membership": [("get", {}, {"ids": [1, 2, 7]}, True)],
+    "user:register": [("post", {}, {
+        "username": "explain-new-user",
+        "password": PASSWORD,
+        "security_question": {"question": "question", "answer": "answer"},
+    }, False)],
+    "user:login": [("post", {}, {"username": "explain-user-0", "password": PASSWORD}, False)],
+    "user:reset-password": [
+        ("get", {"username": "explain-user-1"}, {}, False),
+        ("post", {"username": "explain-user-1"}, {"password": PASSWORD, "answer": "answer"}, False),
+    ],
+    "user:logout": [("post", {}, {}, True)],
+}
+SKIPPED_ENDPOINTS = {
+    "movie:export": "exports read whole tables in id order by design",
+}
+EXPLAINED_NAMESPACES = ["movie", "user"]
+
+# A SCAN of a table without an index reads every row, unless it is the outer loop of a query that walks the
+# table in the order of the query and stops at its LIMIT.
+TABLE_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW\b|\(subquery)(?P<table>\S+)(?: AS \S+)?$")
+LIMIT = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+
+
+class Command(BaseCommand):
+    help = (
+        "Send requests to every endpoint against a throwaway database with a small dataset, run EXPLAIN "
+        "QUERY PLAN on every SQL statement they execute and fail when a plan reads a whole table. Plans with "
+        "full scans are printed, all plans with --verbosity 2."
+    )
+    requires_system_checks = []
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        if connection.vendor != "sqlite":
+            raise CommandError("EXPLAIN QUERY PLAN is only supported on SQLite.")
+        names = self.get_endpoint_names()
+        missing = names - ENDPOINT_REQUESTS.keys() - SKIPPED_ENDPOINTS.keys()
+        if missing:
+            raise CommandError(f"No requests are defined for: {', '.join(sorted(missing))}")
+        # All requests come from one client address, which the auth throttles would soon reject.
+        with override_settings(AUTH_THROTTLE_RATES={}, CACHES=EXPLAIN_CACHES):
+            cache.clear()
+            version_cache.clear()
+            # SQLite test databases are in memory unless a TEST NAME is configured.
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.seed()
+                scans = self.explain_endpoints()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, reason in SKIPPED_ENDPOINTS.items():
+            self.stdout.write(f"{name}: skipped, {reason}")
+        if scans:
+            raise CommandError(f"Full table scans on: {', '.join(sorted(scans))}")
+
+    def get_endpoint_names(self):
+        resolver = get_resolver()
+        return {
+            f"{namespace}:{name}"
+            for namespace in EXPLAINED_NAMESPACES
+            for name in resolver.namespace_dict[namespace][1].reverse_dict
+            if isinstance(name, str)
+        }
+
+    def seed(self):
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create(User(username=f"explain-user-{i}", password=password) for i in range(3))
+        SecurityQuestion.objects.bulk_create(
+            SecurityQuestion(user=user, question="question", answer="answer") for user in users
+        )
+        self.token = Token.objects.create(user=users[0]).key
+        movies = Movie.objects.bulk_create(
+            Movie(
+                id=i,
+                name=f"Movie {i}",
+                director=f"Director {i % 3}",
+                created_year=1995 + i % 10,
+                length_minutes=90 + i,
+                imdb_rating=40 + i,
+                story="Story.",
+            )
+            for i in range(1, 21)
+        )
+        MovieRating.objects.bulk_create(
+            MovieRating(user=user, movie=movie, rating=1 + (user.id + movie.id) % 5)
+            for user in users[1:]
+            for movie in movies
+        )
+        MovieRating.objects.create(user=users[0], movie=movies[0], rating=5)
+        SimilarMovie.objects.bulk_create(
+            SimilarMovie(movie=movies[0], similar_movie=movie, rank=rank, score=1 / (rank + 1))
+            for rank, movie in enumerate(movies[1:6])
+        )
+        Movie.objects.rebuild_rating_stats()
+        MovieRanking.objects.rebuild()
+        MovieList.get_watchlist(users[0])[0].movies.add(*movies[:6])
+        MovieList.objects.create(user=users[0], name="Classics").movies.add(*movies[2:8])
+
+    def explain_endpoints(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        anonymous, authenticated = Client(), Client(HTTP_AUTHORIZATION=f"Token {self.token}")
+        scans = set()
+        for name, requests in ENDPOINT_REQUESTS.items():
+            for method, kwargs, data, is_authenticated in requests:
+                client = authenticated if is_authenticated else anonymous
+                path = reverse(name, kwargs=kwargs)
+                statements.clear()
+                with connection.execute_wrapper(record):
+                    response = self.send(client, method, path, data)
+                    # Later pages seek past a cursor, which takes a different plan than the first page.
+                    if method == "get" and isinstance(response.data, dict) and response.data.get("next"):
+                        client.get(response.data["next"])
+                self.stdout.write(f"{name}: {method.upper()} {path} {response.status_code}")
+                if response.status_code >= 400:
+                    raise CommandError(f"{method.upper()} {path} failed: {response.content.decode()}")
+                for sql, params in list(statements):
+                    if self.explain(sql, params):
+                        scans.add(name)
+        return scans
+
+    def send(self, client, method, path, data):
+        if method in ("get", "delete"):
+            return getattr(client, method)(path, data)
+        return getattr(client, method)(path, data, content_type="application/json")
+
+    def explain(self, sql, params):
+        """
+        Print the plan of a statement that reads tables and return whether it scans a whole table.
+        """
+        if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [(node_id, parent_id, detail) for node_id, parent_id, _, detail in cursor.fetchall()]
+        # Only the outermost loop of the outermost query stops at its LIMIT, and only when its rows are not
+        # sorted afterwards. Scans in subqueries and inner loops read their whole table every time.
+        top_level = [(node_id, detail) for node_id, parent_id, detail in plan if parent_id == 0]
+        outer_loop = next((node_id for node_id, detail in top_level if detail.startswith(("SCAN", "SEARCH"))), None)
+        is_limited = LIMIT.search(strip_parentheses(sql)) and not any("TEMP B-TREE" in d for _, d in top_level)
+        scans = {
+            node_id for node_id, _, detail in plan
+            if TABLE_SCAN.match(detail) and not (is_limited and node_id == outer_loop)
+        }
+        if scans or self.verbosity > 1:
+            self.stdout.write(f"    {sql % tuple(params or ())}")
+            for node_id, _, detail in plan:
+                self.stdout.write(f"      {'!' if node_id in scans else ' '} {detail}")
+        return bool(scans)
+
+
+def strip_parentheses(sql):
+    """
+    Return `sql` without the parts in parentheses, such as subqueries.
+    """
+    depth = 0
+    outer = []
+    for char in sql:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0:
+            outer.append(char)
+    return "".join(outer)
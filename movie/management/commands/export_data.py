@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from movie.export import EXPORT_FORMATS, EXPORTS, iter_export
+
+
+class Command(BaseCommand):
+    help = "Stream the ratings or the movie catalogue as CSV or JSON lines, for analytics."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=list(EXPORTS))
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv", dest="export_format")
+        parser.add_argument("--output", help="Path of the file to write, standard output by default.")
+
+    def handle(self, *args, **options):
+        chunks = iter_export(options["dataset"], options["export_format"])
+        if options["output"] is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(options["output"], "w", newline="", encoding="utf-8") as output:
+            output.writelines(chunks)
+        self.stderr.write(f"Exported {options['dataset']} to {options['output']}.")
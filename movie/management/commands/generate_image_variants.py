@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+
+from movie.images import generate_image_variants, get_stale_image_fields
+from movie.models import Movie
+
+
+class Command(BaseCommand):
+    help = "Generate the resized logo and header image variants of movies that miss them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate the variants of every movie, even if they are up to date.",
+        )
+
+    def handle(self, *args, **options):
+        updated = 0
+        for movie in Movie.objects.only("id", "logo", "header_image", "image_variants").iterator(chunk_size=100):
+            field_names = None if options["force"] else get_stale_image_fields(movie)
+            if field_names == []:
+                continue
+            image_variants = generate_image_variants(movie, field_names)
+            Movie.objects.filter(id=movie.id).update(image_variants=image_variants)
+            updated += 1
+        self.stdout.write(f"Generated image variants of {updated} movies.")
@@ -0,0 +1,44 @@
+from django.core.management import BaseCommand, CommandError
+
+from movie.loader import LOAD_BATCH_SIZE, DatasetLoader, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Load movies, users, ratings and watchlists from CSV or JSON lines files, such as the MovieLens "
+        "movies.csv and ratings.csv or the output of export_data. Rows that already exist are skipped, movies "
+        "whose id belongs to a different movie are refused."
+    )
+    # In loading order, ratings and watchlists refer to the movies and users.
+    datasets = ["movies", "users", "ratings", "watchlists"]
+
+    def add_arguments(self, parser):
+        for dataset in self.datasets:
+            parser.add_argument(f"--{dataset}", metavar="PATH", help=f"File of {dataset} to load.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Format of the files, by default from their extension.",
+        )
+        parser.add_argument("--batch-size", type=int, default=LOAD_BATCH_SIZE)
+        parser.add_argument(
+            "--username-prefix",
+            default="user-",
+            help="Prefix of the usernames of rows that only have a numeric user id.",
+        )
+
+    def handle(self, *args, **options):
+        if not any(options[dataset] for dataset in self.datasets):
+            raise CommandError("Pass at least one of " + ", ".join(f"--{dataset}" for dataset in self.datasets))
+        loader = DatasetLoader(batch_size=options["batch_size"], username_prefix=options["username_prefix"])
+        for dataset in self.datasets:
+            if options[dataset] is None:
+                continue
+            try:
+                rows = read_rows(options[dataset], options["format"])
+                read, written, rate = getattr(loader, f"load_{dataset}")(rows)
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f"Could not load {options[dataset]}: {error!r}")
+            self.stdout.write(f"Read {read} {dataset} and wrote {written}, {rate:.0f} rows/s.")
+        loader.finish()
+        self.stdout.write("Rebuilt rating stats and rankings.")
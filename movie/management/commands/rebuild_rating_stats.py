@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from movie.models import Movie, MovieRanking
+from movie.response_cache import invalidate_catalogue
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored rating count, sum and average of every movie from MovieRating, and the ranking."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Movie.objects.rebuild_rating_stats()
+            MovieRanking.objects.rebuild()
+        invalidate_catalogue()
+        self.stdout.write(f"Rebuilt rating stats of {updated} movies.")
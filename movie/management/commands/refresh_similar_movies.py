@@ -0,0 +1,21 @@
+import time
+
+from django.core.management import BaseCommand
+
+from movie.similarity import refresh_similar_movies
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the similar movies of the movies whose ratings changed since the last run. Meant to run "
+        "periodically, e.g. from cron. Every run loads the whole ratings matrix, incremental runs only "
+        "recompute fewer movies."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recompute the similar movies of every movie.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refreshed = refresh_similar_movies(full=options["full"])
+        self.stdout.write(f"Refreshed similar movies of {refreshed} movies in {time.perf_counter() - started:.2f}s.")
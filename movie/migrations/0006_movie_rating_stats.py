@@ -0,0 +1,52 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:18
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def rebuild_rating_stats(apps, schema_editor):
+    Movie = apps.get_model("movie", "Movie")
+    MovieRating = apps.get_model("movie", "MovieRating")
+    ratings = MovieRating.objects.filter(movie_id=models.OuterRef("id")).order_by().values("movie_id")
+    Movie.objects.update(
+        rating_count=Coalesce(
+            models.Subquery(ratings.annotate(count=models.Count("id")).values("count")[:1]),
+            models.Value(0),
+        ),
+        rating_sum=Coalesce(
+            models.Subquery(ratings.annotate(sum=models.Sum("rating")).values("sum")[:1]),
+            models.Value(0),
+        ),
+        overall_rating=models.Subquery(
+            ratings.annotate(
+                average_rating=models.Avg("rating", output_field=models.FloatField()),
+            ).values("average_rating")[:1],
+            output_field=models.FloatField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0005_alter_movielist_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='overall_rating',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(rebuild_rating_stats, migrations.RunPython.noop),
+    ]
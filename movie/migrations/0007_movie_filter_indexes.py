@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0006_movie_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['director', 'id'], name='movie_director_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['created_year', 'id'], name='movie_created_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['length_minutes', 'id'], name='movie_length_minutes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['imdb_rating', 'id'], name='movie_imdb_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['overall_rating', 'id'], name='movie_overall_rating_idx'),
+        ),
+    ]
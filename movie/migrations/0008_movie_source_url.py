@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0007_movie_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='source_url',
+            field=models.URLField(blank=True, max_length=512, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0008_movie_source_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0009_movie_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='similar_movies_stale',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SimilarMovie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_movies', to='movie.movie')),
+                ('similar_movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='movie.movie')),
+            ],
+            options={
+                'ordering': ['movie', 'rank'],
+                'unique_together': {('movie', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+IMDB_RATING_MAX = 100
+RANKING_PRIOR_WEIGHT = 10
+
+
+def rebuild_rankings(apps, schema_editor):
+    Movie = apps.get_model("movie", "Movie")
+    MovieRanking = apps.get_model("movie", "MovieRanking")
+    rankings = []
+    for movie_id, created_year, imdb_rating, rating_count, rating_sum in Movie.objects.values_list(
+        "id", "created_year", "imdb_rating", "rating_count", "rating_sum",
+    ).iterator():
+        prior = max(min(1 + 4 * imdb_rating / IMDB_RATING_MAX, 5), 1)
+        score = (RANKING_PRIOR_WEIGHT * prior + rating_sum) / (RANKING_PRIOR_WEIGHT + rating_count)
+        rankings.append(MovieRanking(movie_id=movie_id, created_year=created_year, score=score))
+    MovieRanking.objects.bulk_create(rankings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0010_similar_movies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieRanking',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='movie.movie')),
+                ('created_year', models.IntegerField()),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='movieranking',
+            index=models.Index(fields=['score', 'movie'], name='ranking_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movieranking',
+            index=models.Index(fields=['created_year', 'score', 'movie'], name='ranking_year_score_idx'),
+        ),
+        migrations.RunPython(rebuild_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:08
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def rebuild_rating_histograms(apps, schema_editor):
+    Movie = apps.get_model("movie", "Movie")
+    MovieRating = apps.get_model("movie", "MovieRating")
+    ratings = MovieRating.objects.filter(movie_id=models.OuterRef("id")).order_by().values("movie_id")
+    Movie.objects.update(**{
+        f"rating_{star}_count": Coalesce(
+            models.Subquery(ratings.filter(rating=star).annotate(count=models.Count("id")).values("count")[:1]),
+            models.Value(0),
+        )
+        for star in range(1, 6)
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0011_movie_ranking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='movierating',
+            index=models.Index(fields=['movie', 'id'], name='rating_movie_id_idx'),
+        ),
+        migrations.RunPython(rebuild_rating_histograms, migrations.RunPython.noop),
+    ]
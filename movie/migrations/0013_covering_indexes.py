@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0012_movie_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movierating',
+            index=models.Index(fields=['movie', 'rating'], name='rating_movie_rating_idx'),
+        ),
+        # The auto-created through table of MovieList.movies can not declare indexes. Its unique index on
+        # (movielist_id, movie_id) serves lookups by list; this one answers which lists contain a movie
+        # without reading the table rows.
+        migrations.RunSQL(
+            sql='CREATE INDEX "movielist_movies_movie_list_idx" '
+                'ON "movie_movielist_movies" ("movie_id", "movielist_id");',
+            reverse_sql='DROP INDEX "movielist_movies_movie_list_idx";',
+        ),
+    ]
@@ -1,25 +1,84 @@
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, NullIf
+
+# imdb_rating holds the TMDB user score in percent. It is mapped onto the 1-5 scale of MovieRating and
+# acts as the prior of the ranking score with the weight of RANKING_PRIOR_WEIGHT ratings.
+IMDB_RATING_MAX = 100
+RANKING_PRIOR_WEIGHT = 10
+
+RATING_STARS = range(1, 6)
+
+
+def get_rating_histogram_field(star):
+    return f"rating_{star}_count"
 
 
 class MovieQuerySet(models.QuerySet):
-    def annotate_overall_rating(self):
+    def annotate_can_rate(self, user):
+        if not user.is_authenticated:
+            return self.annotate(can_rate=models.Value(False, models.BooleanField()))
         return self.annotate(
-            overall_rating=models.Subquery(
-                MovieRating.objects.filter(movie_id=models.OuterRef("id")).values("movie_id").annotate(
-                    average_rating=models.Avg("rating", output_field=models.FloatField()),
-                ).values("average_rating")[:1],
-                output_field=models.FloatField(),
+            can_rate=~models.Exists(MovieRating.objects.filter(movie_id=models.OuterRef("id"), user_id=user.id)),
+        )
+
+    def add_rating(self, rating):
+        histogram_field = get_rating_histogram_field(rating)
+        return self.update(
+            **{histogram_field: models.F(histogram_field) + 1},
+            rating_count=models.F("rating_count") + 1,
+            rating_sum=models.F("rating_sum") + rating,
+            overall_rating=Cast(models.F("rating_sum") + rating, models.FloatField()) / (models.F("rating_count") + 1),
+            similar_movies_stale=True,
+        )
+
+    def remove_rating(self, rating):
+        histogram_field = get_rating_histogram_field(rating)
+        return self.update(
+            **{histogram_field: models.F(histogram_field) - 1},
+            rating_count=models.F("rating_count") - 1,
+            rating_sum=models.F("rating_sum") - rating,
+            overall_rating=Cast(models.F("rating_sum") - rating, models.FloatField()) / NullIf(
+                models.F("rating_count") - 1, models.Value(0),
             ),
+            similar_movies_stale=True,
         )
 
-    def annotate_is_in_watchlist(self, watchlist):
-        if watchlist is None:
-            return self.annotate(is_in_watchlist=models.Value(False, models.BooleanField()))
+    def annotate_ranking_score(self):
+        prior = Greatest(
+            Least(1 + 4 * models.F("imdb_rating") / IMDB_RATING_MAX, models.Value(5.0)),
+            models.Value(1.0),
+        )
         return self.annotate(
-            is_in_watchlist=models.Exists(
-                MovieList.movies.through.objects.filter(movie_id=models.OuterRef("id"), movielist_id=watchlist.id),
+            ranking_score=(RANKING_PRIOR_WEIGHT * prior + models.F("rating_sum")) / (
+                RANKING_PRIOR_WEIGHT + models.F("rating_count")
+            ),
+        )
+
+    def rebuild_rating_stats(self):
+        ratings = MovieRating.objects.filter(movie_id=models.OuterRef("id")).order_by().values("movie_id")
+        return self.update(
+            **{
+                get_rating_histogram_field(star): Coalesce(
+                    models.Subquery(ratings.filter(rating=star).annotate(count=models.Count("id")).values("count")[:1]),
+                    models.Value(0),
+                )
+                for star in RATING_STARS
+            },
+            rating_count=Coalesce(
+                models.Subquery(ratings.annotate(count=models.Count("id")).values("count")[:1]),
+                models.Value(0),
+            ),
+            rating_sum=Coalesce(
+                models.Subquery(ratings.annotate(sum=models.Sum("rating")).values("sum")[:1]),
+                models.Value(0),
+            ),
+            overall_rating=models.Subquery(
+                ratings.annotate(
+                    average_rating=models.Avg("rating", output_field=models.FloatField()),
+                ).values("average_rating")[:1],
+                output_field=models.FloatField(),
             ),
         )
 
@@ -34,12 +93,84 @@ class Movie(models.Model):
     logo = models.ImageField()
     header_image = models.ImageField()
     story = models.TextField()
+    source_url = models.URLField(max_length=512, null=True, blank=True, unique=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    overall_rating = models.FloatField(null=True, editable=False)
+    # Number of ratings of every star, maintained with the stats above.
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    # Set whenever the movie's ratings change, cleared by the refresh_similar_movies job.
+    similar_movies_stale = models.BooleanField(default=True, editable=False)
 
     def __str__(self):
         return f"{self.name} ({self.created_year})"
 
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, get_rating_histogram_field(star)) for star in RATING_STARS}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["director", "id"], name="movie_director_idx"),
+            models.Index(fields=["created_year", "id"], name="movie_created_year_idx"),
+            models.Index(fields=["length_minutes", "id"], name="movie_length_minutes_idx"),
+            models.Index(fields=["imdb_rating", "id"], name="movie_imdb_rating_idx"),
+            models.Index(fields=["overall_rating", "id"], name="movie_overall_rating_idx"),
+        ]
+
+
+class MovieRankingQuerySet(models.QuerySet):
+    def refresh_scores(self):
+        movies = Movie.objects.filter(id=models.OuterRef("movie_id")).annotate_ranking_score()
+        return self.update(
+            score=models.Subquery(movies.values("ranking_score")[:1]),
+            created_year=models.Subquery(movies.values("created_year")[:1]),
+        )
+
+    def rebuild(self):
+        self.all().delete()
+        movies = Movie.objects.annotate_ranking_score().values_list("id", "created_year", "ranking_score")
+        return len(self.bulk_create(
+            (
+                MovieRanking(movie_id=movie_id, created_year=created_year, score=score)
+                for movie_id, created_year, score in movies.iterator(chunk_size=1000)
+            ),
+            batch_size=1000,
+        ))
+
+
+class MovieRanking(models.Model):
+    """
+    Bayesian average of every movie's ratings, with its imdb_rating as the prior. Kept in its own table with
+    the year denormalized, so that /movie/top/ pages through an index in score order.
+    """
+    objects = models.Manager.from_queryset(MovieRankingQuerySet)()
+    movie = models.OneToOneField(to="movie.Movie", on_delete=models.CASCADE, primary_key=True, related_name="ranking")
+    created_year = models.IntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.movie_id}: {self.score:.3f}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["score", "movie"], name="ranking_score_idx"),
+            models.Index(fields=["created_year", "score", "movie"], name="ranking_year_score_idx"),
+        ]
+
+
+class MovieRatingQuerySet(models.QuerySet):
+    def newest(self, movie_id, count):
+        return self.filter(movie_id=movie_id).select_related("user").order_by("-id")[:count]
+
 
 class MovieRating(models.Model):
+    objects = models.Manager.from_queryset(MovieRatingQuerySet)()
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     movie = models.ForeignKey(to="movie.Movie", on_delete=models.CASCADE)
     rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
@@ -52,18 +183,73 @@ class MovieRating(models.Model):
     class Meta:
         unique_together = [("user", "movie")]
         ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["movie", "id"], name="rating_movie_id_idx"),
+            # Covers the per-movie count, sum and histogram aggregates without reading the rating rows.
+            models.Index(fields=["movie", "rating"], name="rating_movie_rating_idx"),
+        ]
+
+
+class SimilarMovie(models.Model):
+    movie = models.ForeignKey(to="movie.Movie", on_delete=models.CASCADE, related_name="similar_movies")
+    similar_movie = models.ForeignKey(to="movie.Movie", on_delete=models.CASCADE, related_name="similar_to")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.movie_id} ~ {self.similar_movie_id} ({self.score:.3f})"
+
+    class Meta:
+        unique_together = [("movie", "rank")]
+        ordering = ["movie", "rank"]
+
+
+class JSONArraySubquery(models.Subquery):
+    """
+    Subquery of a single column that returns its rows as one JSON array, in the order of the subquery.
+    """
+    template = '(SELECT json_group_array("value") FROM (%(subquery)s))'
+    # jsonb rather than json, which psycopg2 would decode before JSONField does. The aggregate of no rows is
+    # NULL, and like json_group_array() it keeps the order in which the sorted subquery yields its rows.
+    postgresql_template = '(SELECT COALESCE(jsonb_agg("value"), \'[]\') FROM (%(subquery)s) AS "values")'
+
+    def __init__(self, queryset, **kwargs):
+        kwargs.setdefault("output_field", models.JSONField())
+        super().__init__(queryset, **kwargs)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template=self.postgresql_template, **extra_context)
+
+
+class MovieListQuerySet(models.QuerySet):
+    def annotate_summary(self, logo_count):
+        """
+        Annotate the number of movies of every list and the logos of its first `logo_count` movies, as
+        correlated subqueries that read the (movielist_id, movie_id) index rather than a grouped join.
+        """
+        movies = MovieList.movies.through.objects.filter(movielist_id=models.OuterRef("id")).order_by()
+        return self.annotate(
+            movie_count=Coalesce(
+                models.Subquery(movies.values("movielist_id").annotate(count=models.Count("id")).values("count")),
+                models.Value(0),
+            ),
+            logos=JSONArraySubquery(
+                movies.exclude(movie__logo="").order_by("id").values(value=models.F("movie__logo"))[:logo_count],
+            ),
+        )
 
 
 class MovieList(models.Model):
     WATCH_LIST_NAME = "watch-list"
 
+    objects = models.Manager.from_queryset(MovieListQuerySet)()
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     name = models.CharField(max_length=64)
     movies = models.ManyToManyField(to="movie.Movie")
 
     @classmethod
     def get_watchlist(cls, user):
-        return cls.objects.get_or_create(user=user)
+        return cls.objects.get_or_create(user=user, name=cls.WATCH_LIST_NAME)
 
     class Meta:
         unique_together = [("user", "name")]
@@ -0,0 +1,45 @@
+import hashlib
+import uuid
+
+from django.db import transaction
+
+from utility.cache import version_cache
+
+CATALOGUE_VERSION_CACHE_KEY = "movie:catalogue-version"
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+
+def get_catalogue_version():
+    version = version_cache.get(CATALOGUE_VERSION_CACHE_KEY)
+    if version is None:
+        version_cache.add(CATALOGUE_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = version_cache.get(CATALOGUE_VERSION_CACHE_KEY)
+    return version
+
+
+async def aget_catalogue_version():
+    version = await version_cache.aget(CATALOGUE_VERSION_CACHE_KEY)
+    if version is None:
+        await version_cache.aadd(CATALOGUE_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = await version_cache.aget(CATALOGUE_VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate_catalogue():
+    version_cache.set(CATALOGUE_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_catalogue_on_commit():
+    # Invalidate right away and once more after commit, so that a request racing the transaction cannot
+    # put the old data back in the cache under the new version.
+    invalidate_catalogue()
+    transaction.on_commit(invalidate_catalogue)
+
+
+def get_response_etag(version, request):
+    digest = hashlib.sha1(f"{version}|{request.accepted_media_type}|{request.build_absolute_uri()}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def get_response_cache_key(version, request):
+    return f"movie:response:{version}:{hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()}"
@@ -0,0 +1,68 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from movie.images import generate_image_variants, get_stale_image_fields
+from movie.models import Movie, MovieList, MovieRanking, MovieRating
+from movie.response_cache import invalidate_catalogue_on_commit
+from movie.watchlist import invalidate_cached_watchlists_on_commit
+
+
+@receiver(post_save, sender=MovieRating)
+def add_rating_to_movie_stats(sender, instance: MovieRating, created, **kwargs):
+    if created:
+        Movie.objects.filter(id=instance.movie_id).add_rating(instance.rating)
+        MovieRanking.objects.filter(movie_id=instance.movie_id).refresh_scores()
+        invalidate_catalogue_on_commit()
+
+
+@receiver(post_delete, sender=MovieRating)
+def remove_rating_from_movie_stats(sender, instance: MovieRating, **kwargs):
+    Movie.objects.filter(id=instance.movie_id).remove_rating(instance.rating)
+    MovieRanking.objects.filter(movie_id=instance.movie_id).refresh_scores()
+    invalidate_catalogue_on_commit()
+
+
+@receiver(post_save, sender=Movie)
+def generate_movie_image_variants(sender, instance: Movie, raw=False, **kwargs):
+    if raw:
+        return
+    stale_fields = get_stale_image_fields(instance)
+    if stale_fields:
+        instance.image_variants = generate_image_variants(instance, stale_fields)
+        Movie.objects.filter(id=instance.id).update(image_variants=instance.image_variants)
+
+
+@receiver(post_save, sender=Movie)
+def update_movie_ranking(sender, instance: Movie, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        score = Movie.objects.filter(id=instance.id).annotate_ranking_score().values_list("ranking_score", flat=True)
+        MovieRanking.objects.create(movie=instance, created_year=instance.created_year, score=score.get())
+    else:
+        MovieRanking.objects.filter(movie_id=instance.id).refresh_scores()
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def invalidate_catalogue_on_movie_change(sender, instance: Movie, **kwargs):
+    invalidate_catalogue_on_commit()
+
+
+@receiver(m2m_changed, sender=MovieList.movies.through)
+def invalidate_watchlist_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action == "pre_clear":
+            movie_lists = instance.movielist_set.all()
+        elif action in ("post_add", "post_remove"):
+            movie_lists = MovieList.objects.filter(id__in=pk_set)
+        else:
+            return
+        invalidate_cached_watchlists_on_commit(movie_lists.values_list("user_id", flat=True))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        invalidate_cached_watchlists_on_commit([instance.user_id])
+
+
+@receiver(post_delete, sender=MovieList)
+def invalidate_watchlist_on_delete(sender, instance: MovieList, **kwargs):
+    invalidate_cached_watchlists_on_commit([instance.user_id])
@@ -0,0 +1,133 @@
+import itertools
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from movie.models import Movie, MovieRating, SimilarMovie
+from movie.response_cache import invalidate_catalogue
+
+SIMILAR_MOVIES_PER_MOVIE = 20
+MIN_COMMON_RATERS = 2
+# Similarities computed from few common raters are shrunk towards zero by count / (count + SHRINKAGE).
+SHRINKAGE = 5
+# Upper bound of the dense similarity block computed at once, in cells.
+BLOCK_CELLS = 4_000_000
+
+
+class RatingMatrix:
+    """
+    Sparse user x movie matrix of ratings centered on each user's mean rating, so that similarities reflect
+    how a movie is rated relative to the user's other movies rather than how generous the user is.
+    """
+
+    def __init__(self, ratings):
+        ratings = np.fromiter(itertools.chain.from_iterable(ratings), dtype=np.int64).reshape(-1, 3)
+        user_ids, movie_ids, values = ratings.T
+        self.movie_ids, movie_indexes = np.unique(movie_ids, return_inverse=True)
+        _, user_indexes = np.unique(user_ids, return_inverse=True)
+        values = values.astype(np.float64)
+        user_means = np.bincount(user_indexes, weights=values) / np.bincount(user_indexes)
+        shape = (user_indexes.max(initial=-1) + 1, len(self.movie_ids))
+
+        indexes = (user_indexes, movie_indexes)
+        self.centered = sparse.csr_matrix((values - user_means[user_indexes], indexes), shape)
+        self.rated = sparse.csr_matrix((np.ones_like(values), indexes), shape)
+        self.centered_by_movie = self.centered.T.tocsr()
+        self.rated_by_movie = self.rated.T.tocsr()
+        self.norms = np.sqrt(np.asarray(self.centered.multiply(self.centered).sum(axis=0)).ravel())
+
+    @classmethod
+    def from_database(cls):
+        return cls(MovieRating.objects.order_by().values_list("user_id", "movie_id", "rating").iterator(10000))
+
+    def get_similar_movies(self, movie_ids, count=SIMILAR_MOVIES_PER_MOVIE):
+        """
+        Return `{movie_id: [(similar_movie_id, score), ...]}` with the `count` most similar movies of every
+        given movie, by shrunk cosine similarity. Movies without ratings map to an empty list.
+        """
+        result = {movie_id: [] for movie_id in movie_ids}
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.searchsorted(self.movie_ids, movie_ids)[np.isin(movie_ids, self.movie_ids)]
+        block_size = max(1, BLOCK_CELLS // max(1, len(self.movie_ids)))
+
+        for start in range(0, len(positions), block_size):
+            block = positions[start:start + block_size]
+            dot_products = (self.centered_by_movie[block] @ self.centered).toarray()
+            common_raters = (self.rated_by_movie[block] @ self.rated).toarray()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores = dot_products / np.outer(self.norms[block], self.norms)
+            scores *= common_raters / (common_raters + SHRINKAGE)
+            scores[~np.isfinite(scores) | (common_raters < MIN_COMMON_RATERS)] = 0
+            scores[np.arange(len(block)), block] = 0
+
+            top = np.argpartition(-scores, min(count, scores.shape[1] - 1), axis=1)[:, :count]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            for position, neighbours, neighbour_scores in zip(block, top, top_scores):
+                positive = neighbour_scores > 0
+                result[int(self.movie_ids[position])] = list(zip(
+                    self.movie_ids[neighbours[positive]].tolist(),
+                    neighbour_scores[positive].tolist(),
+                ))
+        return result
+
+
+def refresh_similar_movies(full=False):
+    """
+    Recompute the stored similar movies of the movies whose ratings changed since the last run, or of all
+    movies when `full` is set. Return the number of movies that were recomputed. Incremental runs still load
+    the whole ratings matrix, they only skip the similarity computations of the movies that did not change.
+    """
+    with transaction.atomic():
+        # Flags are cleared before the ratings are read, so ratings that arrive meanwhile flag the movie again.
+        movies = Movie.objects.filter(similar_movies_stale=True).select_for_update()
+        flagged_ids = list(movies.values_list("id", flat=True))
+        Movie.objects.filter(id__in=flagged_ids).update(similar_movies_stale=False)
+    stale_ids = list(Movie.objects.values_list("id", flat=True)) if full else flagged_ids
+    if not stale_ids:
+        return 0
+    try:
+        similar_movies = save_similar_movies(stale_ids, full)
+    except BaseException:
+        # Flag the movies again, so the next run retries them. Setting flags cannot drop the ones that
+        # ratings set meanwhile.
+        Movie.objects.filter(id__in=flagged_ids).update(similar_movies_stale=True)
+        raise
+    invalidate_catalogue()
+    return len(similar_movies)
+
+
+def save_similar_movies(stale_ids, full):
+    """
+    Compute and store the similar movies of `stale_ids` and of the movies affected by their change, or of
+    every movie when `full` is set. Return them by movie id.
+    """
+    # Besides the changed movies, refresh the movies that listed them and the movies they now list, whose
+    # similarity to them changed the most.
+    movie_ids = set(stale_ids)
+    if not full:
+        movie_ids.update(
+            SimilarMovie.objects.filter(similar_movie_id__in=stale_ids).values_list("movie_id", flat=True),
+        )
+    matrix = RatingMatrix.from_database()
+    similar_movies = matrix.get_similar_movies(sorted(movie_ids))
+    if not full:
+        neighbour_ids = {similar_id for movie_id in stale_ids for similar_id, _ in similar_movies[movie_id]}
+        similar_movies.update(matrix.get_similar_movies(sorted(neighbour_ids - movie_ids)))
+
+    with transaction.atomic():
+        if full:
+            SimilarMovie.objects.all().delete()
+        else:
+            SimilarMovie.objects.filter(movie_id__in=similar_movies.keys()).delete()
+        SimilarMovie.objects.bulk_create(
+            (
+                SimilarMovie(movie_id=movie_id, similar_movie_id=similar_movie_id, rank=rank, score=score)
+                for movie_id, neighbours in similar_movies.items()
+                for rank, (similar_movie_id, score) in enumerate(neighbours)
+            ),
+            batch_size=1000,
+        )
+    return similar_movies
@@ -1,3 +1,1439 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import os
+import random
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from urllib.parse import urlencode, urlsplit
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from model_bakery import baker
+from PIL import Image
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from rest_framework.throttling import AnonRateThrottle
+
+from movie import async_views, export
+from movie.export import iter_export
+from movie.management.commands import explain_queries
+from movie.models import Movie, MovieRanking, MovieRating, MovieList, SimilarMovie
+from movie.response_cache import get_catalogue_version
+from movie.similarity import RatingMatrix, refresh_similar_movies
+from movie.watchlist import EMPTY_WATCHLIST, get_cached_watchlist, get_watchlist_cache_key
+from user.models import SecurityQuestion
+from utility.authentication import token_cache
+from utility.throttling import throttle_buckets
+
+
+class MovieRatingStatsTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = baker.make(Movie)
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+
+    def make_request(self, rating):
+        return self.client.post(
+            reverse("movie:create_rating", args=[self.movie.id]),
+            data={
+                "rating": rating,
+                "comment": "",
+            },
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+        )
+
+    def test_create_rating_updates_stats(self):
+        baker.make(MovieRating, movie=self.movie, rating=2)
+        response = self.make_request(5)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 2)
+        self.assertEqual(self.movie.rating_sum, 7)
+        self.assertEqual(self.movie.overall_rating, 3.5)
+
+    def test_delete_rating_updates_stats(self):
+        ratings = baker.make(MovieRating, movie=self.movie, rating=4, _quantity=2)
+        ratings[0].delete()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 1)
+        self.assertEqual(self.movie.overall_rating, 4)
+
+        MovieRating.objects.all().delete()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 0)
+        self.assertEqual(self.movie.rating_sum, 0)
+        self.assertIsNone(self.movie.overall_rating)
+
+    def test_rebuild_rating_stats(self):
+        baker.make(MovieRating, movie=self.movie, rating=1)
+        baker.make(MovieRating, movie=self.movie, rating=2)
+        unrated = baker.make(Movie)
+        Movie.objects.update(rating_count=10, rating_sum=10, overall_rating=1)
+        version = get_catalogue_version()
+
+        call_command("rebuild_rating_stats", stdout=StringIO())
+
+        self.assertNotEqual(get_catalogue_version(), version)
+
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum, self.movie.overall_rating), (2, 3, 1.5))
+        unrated.refresh_from_db()
+        self.assertEqual((unrated.rating_count, unrated.rating_sum, unrated.overall_rating), (0, 0, None))
+
+    def test_list_reads_stored_rating(self):
+        baker.make(MovieRating, movie=self.movie, rating=3)
+        response = self.client.get(reverse("movie:list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"][0]["overall_rating"], 3)
+
+
+class MoviePaginationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = baker.make(Movie, _quantity=25)
+        for movie in self.movies:
+            movie.created_year = random.randint(1990, 1995)
+            movie.overall_rating = random.choice([None, 1, 2.5, 4])
+        Movie.objects.bulk_update(self.movies, ["created_year", "overall_rating"])
+
+    def make_request(self, url=None, **params):
+        if url is not None:
+            url = urlsplit(url)
+            return self.client.get(f"{url.path}?{url.query}")
+        return self.client.get(reverse("movie:list"), data=params)
+
+    def collect(self, ordering, page_size=4):
+        ids = []
+        response = self.make_request(ordering=ordering, page_size=page_size)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            result = response.json()
+            self.assertLessEqual(len(result["results"]), page_size)
+            ids.extend(movie["id"] for movie in result["results"])
+            if result["next"] is None:
+                return ids, result
+            response = self.make_request(result["next"])
+
+    def expected_ids(self, field, descending):
+        def key(movie):
+            value = getattr(movie, field)
+            return (value is not None, value if value is not None else 0, movie.id)
+
+        return [movie.id for movie in sorted(self.movies, key=key, reverse=descending)]
+
+    def test_orderings(self):
+        for field in ["id", "created_year", "imdb_rating", "overall_rating"]:
+            for descending in [False, True]:
+                ordering = f"-{field}" if descending else field
+                with self.subTest(ordering=ordering):
+                    ids, _ = self.collect(ordering)
+                    self.assertEqual(ids, self.expected_ids(field, descending))
+
+    def test_previous(self):
+        _, last_page = self.collect("overall_rating")
+        ids = [movie["id"] for movie in last_page["results"]]
+        result = last_page
+        while result["previous"] is not None:
+            result = self.make_request(result["previous"]).json()
+            ids = [movie["id"] for movie in result["results"]] + ids
+        self.assertEqual(ids, self.expected_ids("overall_rating", False))
+
+    def test_invalid_cursor(self):
+        response = self.make_request(cursor="garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_malformed_cursor(self):
+        for payload in [
+            ["overall_rating", [1], 5, False],
+            ["overall_rating", {"a": 1}, 5, False],
+            ["overall_rating", True, 5, False],
+            ["overall_rating", "high", 5, False],
+            ["overall_rating", 2.5, True, False],
+            ["overall_rating", 2.5, "5", False],
+        ]:
+            with self.subTest(payload=payload):
+                cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+                response = self.make_request(ordering="overall_rating", cursor=cursor)
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_of_other_ordering(self):
+        next_url = self.make_request(ordering="created_year", page_size=2).json()["next"]
+        response = self.make_request(next_url.replace("ordering=created_year", "ordering=-id"))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_ordering(self):
+        response = self.make_request(ordering="story")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("ordering", response.json())
+
+
+class MoviePaginationCostTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        baker.make(Movie, _quantity=3000, _bulk_create=True)
+
+    def capture_page(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), [query["sql"] for query in context.captured_queries]
+
+    def test_deep_page_costs_like_first_page(self):
+        for ordering in ["-id", "created_year", "-overall_rating"]:
+            with self.subTest(ordering=ordering):
+                result, first_queries = self.capture_page(reverse("movie:list"), ordering=ordering, page_size=50)
+                for _ in range(40):
+                    url = urlsplit(result["next"])
+                    result, queries = self.capture_page(url.path + "?" + url.query)
+                self.assertEqual(len(result["results"]), 50)
+                self.assertEqual(len(queries), len(first_queries))
+                for sql in first_queries + queries:
+                    self.assertNotIn("OFFSET", sql)
+
+    def test_watchlist_is_paginated(self):
+        user = baker.make(User)
+        token = Token.objects.create(user=user)
+        watchlist = baker.make(MovieList, user=user, name=MovieList.WATCH_LIST_NAME)
+        watchlist.movies.set(Movie.objects.all()[:30])
+        response = self.client.get(
+            reverse("movie:retrieve_watchlist"),
+            data={"page_size": 20},
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()
+        self.assertEqual(len(result["results"]), 20)
+        self.assertIsNotNone(result["next"])
+
+
+class RetrieveMovieAPITest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = baker.make(Movie)
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+
+    def make_request(self, token=None):
+        headers = {"HTTP_AUTHORIZATION": f"Token {token.key}"} if token else {}
+        return self.client.get(reverse("movie:retrieve", args=[self.movie.id]), **headers)
+
+    def test_can_rate(self):
+        self.assertFalse(self.make_request().json()["can_rate"])
+        self.assertTrue(self.make_request(self.token).json()["can_rate"])
+        baker.make(MovieRating, user=self.user, movie=self.movie, rating=2, comment="meh")
+        result = self.make_request(self.token).json()
+        self.assertFalse(result["can_rate"])
+        self.assertEqual(result["ratings"], [{"username": self.user.username, "rating": 2, "comment": "meh"}])
+
+    def test_latest_ratings_and_histogram(self):
+        ratings = [baker.make(MovieRating, movie=self.movie, rating=star) for star in [5, 4, 4, 1, 5, 5, 3] * 2]
+        with self.assertNumQueries(2):
+            result = self.make_request().json()
+        self.assertEqual(
+            [rating["username"] for rating in result["ratings"]],
+            [rating.user.username for rating in reversed(ratings)][:10],
+        )
+        self.assertEqual(result["rating_count"], 14)
+        self.assertEqual(result["rating_histogram"], {"1": 2, "2": 0, "3": 2, "4": 4, "5": 6})
+
+        ratings[0].delete()
+        MovieRating.objects.filter(rating=4).delete()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_histogram, {"1": 2, "2": 0, "3": 2, "4": 0, "5": 5})
+        Movie.objects.update(rating_1_count=0, rating_5_count=0)
+        Movie.objects.rebuild_rating_stats()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_histogram, {"1": 2, "2": 0, "3": 2, "4": 0, "5": 5})
+
+
+class MovieRatingListTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = baker.make(Movie)
+        self.ratings = baker.make(MovieRating, movie=self.movie, rating=3, _quantity=7)
+        baker.make(MovieRating, rating=3, _quantity=3)
+
+    def test_pagination(self):
+        ids, url = [], reverse("movie:ratings", args=[self.movie.id]) + "?page_size=3"
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                data = self.client.get(url).json()
+            ids += [rating["username"] for rating in data["results"]]
+            url = data["next"]
+        self.assertEqual(ids, [rating.user.username for rating in reversed(self.ratings)])
+
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + context.captured_queries[-1]["sql"])
+            plan = " | ".join(row[-1] for row in cursor.fetchall())
+        self.assertRegex(plan, r"movie_movierating USING (COVERING )?INDEX \w+ \(movie_id=\? AND id<\?\)")
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_missing_movie(self):
+        response = self.client.get(reverse("movie:ratings", args=[self.movie.id + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse("movie:ratings", args=[baker.make(Movie).id]))
+        self.assertEqual(response.json()["results"], [])
+
+
+class MovieFilterTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.old = baker.make(Movie, director="Kiarostami", created_year=1990, length_minutes=95, imdb_rating=8)
+        self.new = baker.make(Movie, director="Farhadi", created_year=2011, length_minutes=123, imdb_rating=8.3)
+        self.short = baker.make(Movie, director="Farhadi", created_year=2003, length_minutes=70, imdb_rating=6.5)
+        baker.make(MovieRating, movie=self.new, rating=5)
+        baker.make(MovieRating, movie=self.short, rating=2)
+
+    def make_request(self, **params):
+        return self.client.get(reverse("movie:list"), data=params)
+
+    def result_ids(self, **params):
+        response = self.make_request(**params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [movie["id"] for movie in response.json()["results"]]
+
+    def test_filters(self):
+        self.assertEqual(self.result_ids(director="Farhadi"), [self.short.id, self.new.id])
+        self.assertEqual(self.result_ids(created_year_min=2000, created_year_max=2010), [self.short.id])
+        self.assertEqual(self.result_ids(length_minutes_min=90, length_minutes_max=100), [self.old.id])
+        self.assertEqual(self.result_ids(imdb_rating_min=8), [self.new.id, self.old.id])
+        self.assertEqual(self.result_ids(overall_rating_min=3), [self.new.id])
+
+    def test_filter_and_ordering(self):
+        self.assertEqual(
+            self.result_ids(director="Farhadi", ordering="-created_year"),
+            [self.new.id, self.short.id],
+        )
+        self.assertEqual(
+            self.result_ids(length_minutes_min=80, ordering="length_minutes"),
+            [self.old.id, self.new.id],
+        )
+
+    def test_invalid_filter(self):
+        response = self.make_request(created_year_min="old")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("created_year_min", response.json())
+
+
+@skipUnless(connection.vendor == "sqlite", "Query plans are checked against SQLite.")
+class MovieQueryPlanTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        baker.make(Movie, _quantity=50, _bulk_create=True)
+
+    def get_query_plan(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("movie:list"), data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + context.captured_queries[-1]["sql"])
+            return " | ".join(row[-1] for row in cursor.fetchall())
+
+    def test_common_combinations_use_indexes(self):
+        combinations = [
+            ({"director": "x"}, "movie_director_idx"),
+            ({"ordering": "director"}, "movie_director_idx"),
+            ({"created_year_min": 1990, "created_year_max": 2000}, "movie_created_year_idx"),
+            ({"created_year_min": 1990, "ordering": "created_year"}, "movie_created_year_idx"),
+            ({"length_minutes_max": 100, "ordering": "length_minutes"}, "movie_length_minutes_idx"),
+            ({"imdb_rating_min": 7, "ordering": "-imdb_rating"}, "movie_imdb_rating_idx"),
+            ({"ordering": "-overall_rating"}, "movie_overall_rating_idx"),
+            ({"overall_rating_min": 3, "ordering": "-overall_rating"}, "movie_overall_rating_idx"),
+        ]
+        for params, index in combinations:
+            with self.subTest(**params):
+                self.assertIn(f"USING INDEX {index}", self.get_query_plan(**params))
+
+
+
+class CoveringIndexTest(TestCase):
+    def get_query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return " | ".join(row[-1] for row in cursor.fetchall())
+
+    def test_rating_aggregates(self):
+        ratings = MovieRating.objects.filter(movie_id=1).order_by()
+        self.assertIn(
+            "USING COVERING INDEX rating_movie_rating_idx",
+            self.get_query_plan(ratings.values("movie_id").annotate(count=Count("id"), sum=Sum("rating"))),
+        )
+        self.assertIn(
+            "USING COVERING INDEX rating_movie_rating_idx (movie_id=? AND rating=?)",
+            self.get_query_plan(ratings.filter(rating=3).values("movie_id").annotate(count=Count("id"))),
+        )
+
+    def test_lists_containing_movies(self):
+        through = MovieList.movies.through.objects.filter(movie_id__in=[1, 2]).values_list("movie_id", "movielist_id")
+        self.assertIn("USING COVERING INDEX movielist_movies_movie_list_idx", self.get_query_plan(through))
+
+    def test_explain_queries_reports_table_scans(self):
+        command = explain_queries.Command(stdout=StringIO())
+        command.verbosity = 1
+        newest_rating = MovieRating.objects.filter(movie=OuterRef("pk")).order_by("-id").values("rating")
+        ratings_by_name = MovieRating.objects.filter(comment=OuterRef("name")).values("rating")
+        for queryset, is_scan in [
+            (Movie.objects.filter(story="x"), True),
+            (Movie.objects.filter(director="x"), False),
+            (Movie.objects.order_by("-id")[:20], False),
+            (Movie.objects.order_by("name")[:20], True),
+            # A LIMIT in a subquery does not stop the scan of the outer query, nor one in the outer query the
+            # scans of a subquery.
+            (Movie.objects.filter(story="x").annotate(rating=Subquery(newest_rating[:1])), True),
+            (Movie.objects.annotate(rating=Subquery(ratings_by_name[:1])).order_by("-id")[:20], True),
+            (Movie.objects.annotate(rating=Subquery(newest_rating[:1])).order_by("-id")[:20], False),
+        ]:
+            with self.subTest(query=str(queryset.query)):
+                self.assertEqual(command.explain(*queryset.query.sql_with_params()), is_scan)
+
+
+TMDB_PAGE = """<html><head><style>div.header.large.first {{ background-image: url(/images/{id}/header.jpg); }}</style></head>
+<body>
+<h2><a href="/movie/{id}">Movie {id}</a> <span class="release_date">(20{id:02d})</span></h2>
+<span class="runtime">2h {id}m</span>
+<div class="percent"><span class="icon icon-r7{id}"></span></div>
+<img class="poster" data-src="/images/{id}/poster.jpg">
+<div class="overview"><p>Story of movie {id}.</p></div>
+<ol><li><p><a href="/person/{id}">Director {id}</a></p><p class="character">Director, Screenplay</p></li></ol>
+</body></html>"""
+
+
+def make_image(size=(60, 90), image_format="JPEG"):
+    output = BytesIO()
+    Image.new("RGB", size, color=(200, 30, 30)).save(output, image_format)
+    return output.getvalue()
+
+
+class TemporaryMediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class TmdbStandInHandler(BaseHTTPRequestHandler):
+    image = make_image()
+    requested_paths = []
+
+    def do_GET(self):
+        self.requested_paths.append(self.path)
+        if self.path.startswith("/movie/") and not self.path.endswith("/missing"):
+            body, content_type = TMDB_PAGE.format(id=int(self.path.rsplit("/", 1)[1])).encode(), "text/html"
+        elif self.path.startswith("/images/"):
+            body, content_type = self.image, "image/jpeg"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AddFromTmdbTest(TemporaryMediaRootMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), TmdbStandInHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        TmdbStandInHandler.requested_paths = []
+
+    def write_urls(self, urls):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+            file.write("\n".join(urls))
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def test_single_url(self):
+        call_command("add_from_tmdb", f"{self.base_url}/movie/7", stdout=StringIO())
+        movie = Movie.objects.get()
+        self.assertEqual(
+            (movie.name, movie.director, movie.created_year, movie.length_minutes, movie.imdb_rating, movie.story),
+            ("Movie 7", "Director 7", 2007, 127, 77, "Story of movie 7."),
+        )
+        self.assertEqual(movie.source_url, f"{self.base_url}/movie/7")
+        self.assertEqual(movie.logo.read(), TmdbStandInHandler.image)
+        self.assertEqual(movie.header_image.read(), TmdbStandInHandler.image)
+
+    def test_bulk_import_is_resumable(self):
+        urls = [f"{self.base_url}/movie/{i}" for i in range(1, 13)]
+        path = self.write_urls(urls[:9] + [f"{self.base_url}/movie/missing"])
+        with self.assertRaises(CommandError):
+            call_command("add_from_tmdb", file=path, workers=4, batch_size=4, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Movie.objects.count(), 9)
+
+        TmdbStandInHandler.requested_paths = []
+        call_command("add_from_tmdb", file=self.write_urls(urls), workers=4, batch_size=4, stdout=StringIO())
+        self.assertEqual(sorted(Movie.objects.values_list("source_url", flat=True)), sorted(urls))
+        self.assertEqual(
+            sorted(path for path in TmdbStandInHandler.requested_paths if path.startswith("/movie/")),
+            ["/movie/10", "/movie/11", "/movie/12"],
+        )
+
+
+class ImageVariantsTest(TemporaryMediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def make_movie(self, logo_size=(500, 750)):
+        return baker.make(
+            Movie,
+            logo=SimpleUploadedFile("logo.jpg", make_image(logo_size)),
+            header_image=SimpleUploadedFile("header.png", make_image((1600, 900), "PNG")),
+        )
+
+    def test_variants_generated_on_upload(self):
+        movie = self.make_movie()
+        movie.refresh_from_db()
+        logo_variants = movie.image_variants["logo"]["variants"]
+        self.assertEqual(
+            [(variant["width"], variant["height"], variant["format"]) for variant in logo_variants],
+            [(92, 138, "jpeg"), (92, 138, "webp"), (185, 278, "jpeg"), (185, 278, "webp"),
+             (342, 513, "jpeg"), (342, 513, "webp")],
+        )
+        header_variants = movie.image_variants["header_image"]["variants"]
+        self.assertEqual({variant["width"] for variant in header_variants}, {780, 1280})
+        for variant in logo_variants + header_variants:
+            self.assertEqual(os.path.dirname(variant["name"]), os.path.dirname(movie.logo.name))
+            with Image.open(default_storage.open(variant["name"])) as image:
+                self.assertEqual(image.size, (variant["width"], variant["height"]))
+                self.assertEqual(image.format, variant["format"].upper())
+
+    def test_small_images_are_not_upscaled(self):
+        movie = self.make_movie(logo_size=(100, 150))
+        widths = {variant["width"] for variant in movie.image_variants["logo"]["variants"]}
+        self.assertEqual(widths, {92, 100})
+
+    def test_serializers_expose_variants(self):
+        movie = self.make_movie()
+        result = self.client.get(reverse("movie:list")).json()["results"][0]
+        self.assertEqual(len(result["logo_variants"]), 6)
+        self.assertTrue(result["logo_variants"][0]["url"].startswith("http://testserver/"))
+        self.assertEqual(result["logo_variants"][0]["width"], 92)
+
+        result = self.client.get(reverse("movie:retrieve", args=[movie.id])).json()
+        self.assertEqual(len(result["header_image_variants"]), 4)
+
+    def test_replacing_image_replaces_variants(self):
+        movie = self.make_movie()
+        old_names = [variant["name"] for variant in movie.image_variants["logo"]["variants"]]
+        movie.logo = SimpleUploadedFile("new-logo.jpg", make_image((200, 300)))
+        movie.save()
+        self.assertEqual(movie.image_variants["logo"]["source"], movie.logo.name)
+        for name in old_names:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_backfill_command(self):
+        movie = self.make_movie()
+        Movie.objects.update(image_variants={})
+        call_command("generate_image_variants", stdout=StringIO())
+        movie.refresh_from_db()
+        self.assertEqual(len(movie.image_variants["logo"]["variants"]), 6)
+        self.assertEqual(len(movie.image_variants["header_image"]["variants"]), 4)
+
+
+class WatchlistTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = baker.make(Movie, _quantity=3)
+        self.user = baker.make(User)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.user).key}")
+
+    def watchlisted_ids(self):
+        return {movie["id"] for movie in self.client.get(reverse("movie:list")).json()["results"] if movie["is_in_watchlist"]}
+
+    def test_reads_do_not_create_watchlist(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("movie:list"))
+            self.client.get(reverse("movie:retrieve", args=[self.movies[0].id]))
+            response = self.client.get(reverse("movie:retrieve_watchlist"))
+        self.assertEqual(response.json()["results"], [])
+        self.assertFalse(MovieList.objects.exists())
+        for query in context.captured_queries:
+            self.assertTrue(query["sql"].startswith("SELECT"), query["sql"])
+
+    def test_watchlist_is_cached(self):
+        self.client.get(reverse("movie:list"))
+        with self.assertNumQueries(1):
+            self.client.get(reverse("movie:list"))
+
+    def test_changes_invalidate_cache_after_commit(self):
+        movie_list = MovieList.get_watchlist(self.user)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            movie_list.movies.add(self.movies[0])
+            # A request that read the watchlist before the commit caches it without the movie.
+            cache.set(get_watchlist_cache_key(self.user.id), EMPTY_WATCHLIST)
+        self.assertEqual(get_cached_watchlist(self.user).movie_ids, {self.movies[0].id})
+
+    def test_add_and_remove_invalidate_cache(self):
+        self.assertEqual(self.watchlisted_ids(), set())
+        self.client.post(reverse("movie:add_to_watchlist", args=[self.movies[0].id]))
+        self.client.post(reverse("movie:add_to_watchlist", args=[self.movies[1].id]))
+        self.assertEqual(self.watchlisted_ids(), {self.movies[0].id, self.movies[1].id})
+        self.client.delete(reverse("movie:add_to_watchlist", args=[self.movies[0].id]))
+        self.assertEqual(self.watchlisted_ids(), {self.movies[1].id})
+        response = self.client.get(reverse("movie:retrieve", args=[self.movies[1].id]))
+        self.assertTrue(response.json()["is_in_watchlist"])
+        response = self.client.get(reverse("movie:retrieve_watchlist"))
+        self.assertEqual([movie["id"] for movie in response.json()["results"]], [self.movies[1].id])
+
+    def test_bulk_update(self):
+        url = reverse("movie:bulk_update_watchlist")
+        ids = [movie.id for movie in self.movies]
+        missing = ids[-1] + 1
+        self.client.post(reverse("movie:add_to_watchlist", args=[ids[0]]))
+        self.assertEqual(self.watchlisted_ids(), {ids[0]})
+
+        with self.assertNumQueries(5):
+            response = self.client.post(url, data={"add": [ids[1], ids[0], missing, ids[1]], "remove": [ids[2]]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            "add": [
+                {"id": ids[1], "result": "added"},
+                {"id": ids[0], "result": "unchanged"},
+                {"id": missing, "result": "not_found"},
+            ],
+            "remove": [{"id": ids[2], "result": "unchanged"}],
+        })
+        self.assertEqual(self.watchlisted_ids(), {ids[0], ids[1]})
+
+        response = self.client.post(url, data={"add": [ids[2]], "remove": [ids[0], ids[1], missing]})
+        results = [result["result"] for result in response.json()["remove"]]
+        self.assertEqual(results, ["removed", "removed", "not_found"])
+        self.assertEqual(self.watchlisted_ids(), {ids[2]})
+
+    def test_bulk_update_validation(self):
+        url = reverse("movie:bulk_update_watchlist")
+        response = self.client.post(url, data={"add": [self.movies[0].id], "remove": [self.movies[0].id]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, data={"add": list(range(1, 502))})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials()
+        response = self.client.post(url, data={"add": [self.movies[0].id]})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(MovieList.objects.filter(movies__isnull=False).exists())
+
+    def test_reverse_changes_invalidate_cache(self):
+        self.client.post(reverse("movie:add_to_watchlist", args=[self.movies[0].id]))
+        self.assertEqual(self.watchlisted_ids(), {self.movies[0].id})
+        self.movies[0].movielist_set.clear()
+        self.assertEqual(self.watchlisted_ids(), set())
+
+
+
+class MovieListTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = Movie.objects.bulk_create(
+            baker.prepare(Movie, logo=logo) for logo in ["", *(f"logos/{i}.jpg" for i in range(1, 6))]
+        )
+        self.user = baker.make(User)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.user).key}")
+        self.client.get(reverse("movie:lists"))
+
+    def create_list(self, name, movies=(), user=None):
+        movie_list = MovieList.objects.create(user=user or self.user, name=name)
+        movie_list.movies.add(*movies)
+        return movie_list
+
+    def test_summary_sql_on_postgresql(self):
+        from django.db.backends.postgresql.base import DatabaseWrapper
+
+        postgresql = DatabaseWrapper({**connection.settings_dict, "ENGINE": "django.db.backends.postgresql"})
+        sql, _ = MovieList.objects.annotate_summary(4).query.get_compiler(connection=postgresql).as_sql()
+        self.assertIn('(SELECT COALESCE(jsonb_agg("value"), \'[]\') FROM (SELECT', sql)
+        self.assertIn('LIMIT 4) AS "values") AS "logos"', sql)
+        self.assertNotIn("json_group_array", sql)
+
+    def test_index(self):
+        first = self.create_list("first", self.movies)
+        second = self.create_list("second", self.movies[4:])
+        empty = self.create_list("empty")
+        self.create_list("other user", self.movies, user=baker.make(User))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("movie:lists"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summaries = [
+            (movie_list["id"], movie_list["name"], movie_list["movie_count"], len(movie_list["logos"]))
+            for movie_list in response.json()
+        ]
+        self.assertEqual(summaries, [(first.id, "first", 6, 4), (second.id, "second", 2, 2), (empty.id, "empty", 0, 0)])
+        self.assertEqual(
+            [url.rsplit("/", 1)[1] for url in response.json()[0]["logos"]],
+            ["1.jpg", "2.jpg", "3.jpg", "4.jpg"],
+        )
+        self.assertTrue(response.json()[0]["logos"][0].startswith("http://testserver/"))
+
+    def test_create_rename_and_delete(self):
+        response = self.client.post(reverse("movie:lists"), data={"name": "favourites"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["movie_count"], 0)
+        self.assertEqual(response.json()["logos"], [])
+        list_id = response.json()["id"]
+        self.assertEqual(
+            self.client.post(reverse("movie:lists"), data={"name": "favourites"}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+        url = reverse("movie:list_detail", args=[list_id])
+        response = self.client.patch(url, data={"name": "best"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["name"], "best")
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(MovieList.objects.filter(id=list_id).exists())
+
+    def test_watchlist_is_protected(self):
+        watchlist = self.create_list(MovieList.WATCH_LIST_NAME)
+        url = reverse("movie:list_detail", args=[watchlist.id])
+        self.assertEqual(self.client.patch(url, data={"name": "other"}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse("movie:lists"), data={"name": MovieList.WATCH_LIST_NAME})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_movies(self):
+        movie_list = self.create_list("list")
+        movie = self.movies[0]
+        self.assertEqual(
+            self.client.post(reverse("movie:list_movie", args=[movie_list.id, movie.id])).status_code,
+            status.HTTP_201_CREATED,
+        )
+        response = self.client.get(reverse("movie:list_movies", args=[movie_list.id]))
+        self.assertEqual([result["id"] for result in response.json()["results"]], [movie.id])
+        self.client.delete(reverse("movie:list_movie", args=[movie_list.id, movie.id]))
+        response = self.client.get(reverse("movie:list_movies", args=[movie_list.id]))
+        self.assertEqual(response.json()["results"], [])
+
+    def test_other_users_lists_are_not_found(self):
+        movie_list = self.create_list("other", self.movies, user=baker.make(User))
+        for response in [
+            self.client.get(reverse("movie:list_detail", args=[movie_list.id])),
+            self.client.get(reverse("movie:list_movies", args=[movie_list.id])),
+            self.client.post(reverse("movie:list_movie", args=[movie_list.id, self.movies[0].id])),
+        ]:
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_membership(self):
+        first = self.create_list("first", self.movies[:2])
+        second = self.create_list("second", self.movies[1:3])
+        self.create_list("other user", self.movies, user=baker.make(User))
+        ids = [movie.id for movie in self.movies[:4]]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("movie:list_membership"), data={"ids": ids})
+        self.assertEqual(response.json()["results"], [
+            {"id": ids[0], "lists": [first.id]},
+            {"id": ids[1], "lists": [first.id, second.id]},
+            {"id": ids[2], "lists": [second.id]},
+            {"id": ids[3], "lists": []},
+        ])
+        response = self.client.get(reverse("movie:list_membership"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MovieResponseCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = baker.make(Movie, name="before")
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+
+    def test_anonymous_list_is_cached(self):
+        self.client.get(reverse("movie:list"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("movie:list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"][0]["name"], "before")
+        self.assertIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+    def test_conditional_get(self):
+        url = reverse("movie:retrieve", args=[self.movie.id])
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        other_etag = self.client.get(reverse("movie:list"))["ETag"]
+        self.assertNotEqual(other_etag, etag)
+
+    def test_if_modified_since_is_ignored(self):
+        url = reverse("movie:retrieve", args=[self.movie.id])
+        self.client.get(url)
+        baker.make(MovieRating, movie=self.movie, rating=4)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["overall_rating"], 4)
+
+    def test_invalidated_by_rating(self):
+        url = reverse("movie:retrieve", args=[self.movie.id])
+        etag = self.client.get(url)["ETag"]
+        baker.make(MovieRating, movie=self.movie, rating=4)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["overall_rating"], 4)
+        self.assertNotEqual(response["ETag"], etag)
+
+        MovieRating.objects.all().delete()
+        self.assertIsNone(self.client.get(url).json()["overall_rating"])
+
+    def test_invalidated_by_movie_edit(self):
+        self.client.get(reverse("movie:list"))
+        self.movie.name = "after"
+        self.movie.save()
+        self.assertEqual(self.client.get(reverse("movie:list")).json()["results"][0]["name"], "after")
+
+    def test_authenticated_is_not_cached(self):
+        self.client.get(reverse("movie:list"))
+        response = self.client.get(reverse("movie:list"), HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertNotIn("ETag", response)
+        self.assertFalse(response.json()["results"][0]["is_in_watchlist"])
+
+    def test_errors_are_not_cached(self):
+        url = reverse("movie:retrieve", args=[self.movie.id + 1])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncMovieViewsTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = baker.make(Movie, _quantity=4, created_year=iter([2001, 2002, 2003, 2004]))
+        for movie in self.movies[:2]:
+            baker.make(MovieRating, movie=movie, rating=random.randint(1, 5), _quantity=2)
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        MovieList.get_watchlist(self.user)[0].movies.add(self.movies[1])
+        self.factory = RequestFactory()
+
+    def call(self, view, method, path, headers=(), **kwargs):
+        cache.clear()
+        request = getattr(self.factory, method)(path, **dict(headers))
+        return async_to_sync(view.as_view())(request, **kwargs)
+
+    def assertSameResponse(self, sync_view_name, async_view, headers=(), data=None, **kwargs):
+        path = reverse(sync_view_name, kwargs=kwargs)
+        if data:
+            path = f"{path}?{urlencode(data)}"
+        cache.clear()
+        expected = self.client.get(path, **dict(headers))
+        response = self.call(async_view, "get", path, headers, **kwargs)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response["Content-Type"], expected["Content-Type"])
+        self.assertEqual(json.loads(response.content), expected.json())
+        return response
+
+    def test_list_matches_sync_view(self):
+        for data in [{}, {"ordering": "created_year", "page_size": 2}, {"created_year_min": 2003}, {"ordering": "x"}]:
+            for headers in [(), self.headers]:
+                with self.subTest(data=data, authenticated=bool(headers)):
+                    self.assertSameResponse("movie:list", async_views.ListMovieAPIView, headers, data)
+
+    def test_retrieve_matches_sync_view(self):
+        for pk in [self.movies[0].id, self.movies[1].id, self.movies[-1].id + 1]:
+            for headers in [(), self.headers]:
+                with self.subTest(pk=pk, authenticated=bool(headers)):
+                    self.assertSameResponse("movie:retrieve", async_views.RetrieveMovieAPIView, headers, pk=pk)
+
+    def test_anonymous_responses_are_cached(self):
+        path = reverse("movie:retrieve", args=[self.movies[0].id])
+        response = self.call(async_views.RetrieveMovieAPIView, "get", path, pk=self.movies[0].id)
+        request = self.factory.get(path, HTTP_IF_NONE_MATCH=response["ETag"])
+        with self.assertNumQueries(0):
+            response = async_to_sync(async_views.RetrieveMovieAPIView.as_view())(request, pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_add_and_remove_from_watchlist(self):
+        view = async_views.AddRemoveMovieToWatchList
+        path = reverse("movie:add_to_watchlist", args=[self.movies[0].id])
+        response = self.call(view, "post", path, pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+        self.assertEqual(get_cached_watchlist(self.user).movie_ids, {self.movies[1].id})
+        for _ in range(2):
+            response = self.call(view, "post", path, self.headers, pk=self.movies[0].id)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_cached_watchlist(self.user).movie_ids, {self.movies[0].id, self.movies[1].id})
+        response = self.call(view, "delete", path, self.headers, pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(get_cached_watchlist(self.user).movie_ids, {self.movies[1].id})
+
+        pk = self.movies[-1].id + 1
+        response = self.call(view, "post", reverse("movie:add_to_watchlist", args=[pk]), self.headers, pk=pk)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.call(view, "put", path, self.headers, pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_negotiation_and_throttling(self):
+        view = async_views.RetrieveMovieAPIView
+        path = reverse("movie:retrieve", args=[self.movies[0].id])
+        response = self.call(view, "get", f"{path}?format=json", pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.call(view, "get", f"{path}?format=xml", pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.call(view, "get", path, {"HTTP_ACCEPT": "application/xml"}, pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+        response = self.call(view, "get", f"{path}?format=api", pk=self.movies[0].id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(self.movies[0].name, response.render().content.decode())
+
+        throttle = type("OncePerMinuteThrottle", (AnonRateThrottle,), {"rate": "1/min"})
+        request = self.factory.get(path)
+        throttled_view = async_to_sync(view.as_view(throttle_classes=[throttle]))
+        self.assertEqual(throttled_view(request, pk=self.movies[0].id).status_code, status.HTTP_200_OK)
+        self.assertEqual(throttled_view(request, pk=self.movies[0].id).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class MovieRankingTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+        self.acclaimed = baker.make(Movie, created_year=2000, imdb_rating=80)
+        self.obscure = baker.make(Movie, created_year=2000, imdb_rating=50)
+        self.panned = baker.make(Movie, created_year=2001, imdb_rating=20)
+        for user in baker.make(User, _quantity=20):
+            baker.make(MovieRating, user=user, movie=self.acclaimed, rating=4)
+            baker.make(MovieRating, user=user, movie=self.panned, rating=2)
+
+    def top_ids(self, **params):
+        response = self.client.get(reverse("movie:top"), data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [movie["id"] for movie in response.json()["results"]]
+
+    def test_few_ratings_do_not_top_the_ranking(self):
+        baker.make(MovieRating, movie=self.obscure, rating=5)
+        self.assertEqual(self.top_ids(), [self.acclaimed.id, self.obscure.id, self.panned.id])
+        self.assertEqual(self.top_ids(year=2000), [self.acclaimed.id, self.obscure.id])
+
+        result = self.client.get(reverse("movie:top")).json()["results"][0]
+        self.assertEqual(result["name"], self.acclaimed.name)
+        # (10 * 4.2 + 20 * 4) / 30
+        self.assertAlmostEqual(result["ranking_score"], 122 / 30)
+
+    def test_rating_updates_ranking(self):
+        for user in baker.make(User, _quantity=30):
+            response = self.client.post(
+                reverse("movie:create_rating", args=[self.obscure.id]),
+                data={"rating": 5},
+                HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}",
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.top_ids()[0], self.obscure.id)
+
+        MovieRating.objects.filter(movie=self.obscure).delete()
+        self.obscure.refresh_from_db()
+        self.assertAlmostEqual(self.obscure.ranking.score, 3.0)
+        self.assertEqual(self.top_ids()[0], self.acclaimed.id)
+
+    def test_rebuild(self):
+        expected = dict(MovieRanking.objects.values_list("movie_id", "score"))
+        MovieRanking.objects.all().delete()
+        self.assertEqual(MovieRanking.objects.rebuild(), 3)
+        self.assertEqual(dict(MovieRanking.objects.values_list("movie_id", "score")), expected)
+
+    def test_pagination(self):
+        baker.make(Movie, imdb_rating=60, _quantity=5)
+        ids = self.top_ids()
+        self.assertEqual(len(ids), 8)
+        pages, url = [], reverse("movie:top") + "?page_size=3"
+        while url:
+            data = self.client.get(url).json()
+            pages += [movie["id"] for movie in data["results"]]
+            url = data["next"]
+        self.assertEqual(pages, ids)
+
+    def test_query_plan(self):
+        for params, index in [({}, "ranking_score_idx"), ({"year": 2000}, "ranking_year_score_idx")]:
+            with self.subTest(**params):
+                with CaptureQueriesContext(connection) as context:
+                    self.top_ids(**params)
+                with connection.cursor() as cursor:
+                    cursor.execute("EXPLAIN QUERY PLAN " + context.captured_queries[-1]["sql"])
+                    plan = " | ".join(row[-1] for row in cursor.fetchall())
+                self.assertRegex(plan, f"USING (COVERING )?INDEX {index}")
+                self.assertNotIn("TEMP B-TREE", plan)
+
+
+class FastListSerializationTest(TemporaryMediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+        self.movies = [
+            baker.make(Movie, logo=SimpleUploadedFile("logo.jpg", make_image((200, 300)))),
+            baker.make(Movie, name="Caf\u00e9 \u2028 \"Noir\"", logo="", imdb_rating=80),
+            *baker.make(Movie, _quantity=3),
+        ]
+        baker.make(MovieRating, movie=self.movies[0], rating=4, _quantity=3)
+        MovieList.get_watchlist(self.user)[0].movies.add(*self.movies[:3])
+
+    def get_both(self, path, **headers):
+        responses = []
+        for fast in (False, True):
+            cache.clear()
+            with self.settings(FAST_LIST_SERIALIZATION=fast):
+                responses.append(self.client.get(path, **headers))
+        return responses
+
+    def assertSameContent(self, path, **headers):
+        expected, response = self.get_both(path, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], expected["Content-Type"])
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_list_is_byte_identical(self):
+        response = self.assertSameContent(reverse("movie:list"))
+        self.assertTrue(response.json()["results"][-1]["logo_variants"])
+        self.assertIn(b"\\u2028", response.content)
+        headers = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        for params in ["?ordering=-overall_rating&page_size=2", "?ordering=created_year", "?director=x"]:
+            with self.subTest(params=params):
+                self.assertSameContent(reverse("movie:list") + params, **headers)
+
+    def test_cursors_are_identical(self):
+        for ordering in ["-overall_rating", "imdb_rating", "-id"]:
+            url = f"{reverse('movie:list')}?ordering={ordering}&page_size=2"
+            while url:
+                expected, response = self.get_both(url)
+                self.assertEqual(response.content, expected.content)
+                url = response.json()["next"]
+
+    def test_watchlist_is_byte_identical(self):
+        self.assertSameContent(reverse("movie:retrieve_watchlist"), HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_async_list(self):
+        for fast in (False, True):
+            cache.clear()
+            with self.subTest(fast=fast), self.settings(FAST_LIST_SERIALIZATION=fast):
+                expected = self.client.get(reverse("movie:list"))
+                cache.clear()
+                request = RequestFactory().get(reverse("movie:list"))
+                response = async_to_sync(async_views.ListMovieAPIView.as_view())(request)
+                self.assertEqual(response.content, expected.content)
+
+
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.movie = baker.make(Movie, story="A long story.")
+        baker.make(MovieRating, movie=self.movie, rating=4, _quantity=2)
+        self.user = baker.make(User)
+        self.token = Token.objects.create(user=self.user)
+        MovieList.get_watchlist(self.user)[0].movies.add(self.movie)
+
+    def get(self, url, num_queries, **params):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(context.captured_queries), num_queries)
+        return response.json(), context.captured_queries[-1]["sql"]
+
+    def test_list(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.client.get(reverse("movie:list"))
+        for fast in (True, False):
+            with self.subTest(fast=fast), self.settings(FAST_LIST_SERIALIZATION=fast):
+                # The watchlist is only read for is_in_watchlist.
+                data, sql = self.get(reverse("movie:list"), 1, fields="id,name,logo")
+                self.assertEqual(list(data["results"][0]), ["id", "name", "logo"])
+                self.assertNotIn('"director"', sql)
+                self.assertNotIn('"image_variants"', sql)
+
+                data, sql = self.get(reverse("movie:list"), 2, omit="logo_variants,director", ordering="-imdb_rating")
+                self.assertNotIn("director", data["results"][0])
+                self.assertTrue(data["results"][0]["is_in_watchlist"])
+                self.assertNotIn('"image_variants"', sql)
+
+    def test_retrieve(self):
+        url = reverse("movie:retrieve", args=[self.movie.id])
+        data, sql = self.get(url, 1, fields="id,name")
+        self.assertEqual(data, {"id": self.movie.id, "name": self.movie.name})
+        self.assertNotIn('"story"', sql)
+
+        data, sql = self.get(url, 2, omit="story,can_rate")
+        self.assertEqual(len(data["ratings"]), 2)
+        self.assertNotIn("story", data)
+        self.assertNotIn('"story"', sql)
+        self.assertEqual(self.get(url, 2)[0]["story"], "A long story.")
+
+        request = RequestFactory().get(url, data={"fields": "id,can_rate"})
+        response = async_to_sync(async_views.RetrieveMovieAPIView.as_view())(request, pk=self.movie.id)
+        self.assertEqual(json.loads(response.content), {"id": self.movie.id, "can_rate": False})
+
+    def test_watchlist(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.client.get(reverse("movie:list"))
+        data, _ = self.get(reverse("movie:retrieve_watchlist"), 2, fields="id")
+        self.assertEqual(data["results"], [{"id": self.movie.id}])
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse("movie:list"), data={"fields": "id,password"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("password", response.json()["fields"][0])
+
+
+class SimilarMoviesTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.movies = baker.make(Movie, _quantity=4)
+        self.users = baker.make(User, _quantity=4)
+        # The first two movies are liked and disliked by the same users, the third one the other way round.
+        for user, ratings in zip(self.users, [(5, 5, 1, 3), (4, 5, 2, 3), (1, 2, 5, 3), (2, 1, 4, 3)]):
+            for movie, rating in zip(self.movies, ratings):
+                baker.make(MovieRating, user=user, movie=movie, rating=rating)
+        # Nobody who rated the others rated this one.
+        self.unrelated_movie = baker.make(Movie)
+        for user in baker.make(User, _quantity=2):
+            baker.make(MovieRating, user=user, movie=self.unrelated_movie, rating=4)
+
+    def similar_ids(self, movie):
+        response = self.client.get(reverse("movie:similar", args=[movie.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [similar["id"] for similar in response.json()]
+
+    def test_similar_movies(self):
+        self.assertEqual(self.similar_ids(self.movies[0]), [])
+        self.assertEqual(refresh_similar_movies(), 5)
+        with self.assertNumQueries(1):
+            similar_ids = self.similar_ids(self.movies[0])
+        self.assertEqual(similar_ids[0], self.movies[1].id)
+        self.assertNotIn(self.movies[2].id, similar_ids)
+        self.assertEqual(self.similar_ids(self.unrelated_movie), [])
+
+        similar = SimilarMovie.objects.get(movie=self.movies[0], rank=0)
+        self.assertGreater(similar.score, 0)
+        response = self.client.get(reverse("movie:similar", args=[self.movies[0].id]))
+        self.assertAlmostEqual(response.json()[0]["similarity"], similar.score)
+
+        response = self.client.get(reverse("movie:similar", args=[self.unrelated_movie.id + 1]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_incremental_refresh(self):
+        refresh_similar_movies()
+        self.assertEqual(refresh_similar_movies(), 0)
+        # New users who like the third movie as much as the first make them similar.
+        for user in baker.make(User, _quantity=6):
+            baker.make(MovieRating, user=user, movie=self.movies[0], rating=5)
+            baker.make(MovieRating, user=user, movie=self.movies[2], rating=5)
+            baker.make(MovieRating, user=user, movie=self.movies[3], rating=1)
+        self.assertEqual(
+            set(Movie.objects.filter(similar_movies_stale=True).values_list("id", flat=True)),
+            {self.movies[0].id, self.movies[2].id, self.movies[3].id},
+        )
+        self.assertEqual(refresh_similar_movies(), 4)
+        self.assertFalse(Movie.objects.filter(similar_movies_stale=True).exists())
+        self.assertIn(self.movies[2].id, self.similar_ids(self.movies[0]))
+
+        expected = RatingMatrix.from_database().get_similar_movies([movie.id for movie in self.movies])
+        for movie in self.movies:
+            stored = SimilarMovie.objects.filter(movie=movie).values_list("similar_movie_id", flat=True)
+            self.assertEqual(list(stored), [similar_id for similar_id, _ in expected[movie.id]])
+
+    def test_failed_refresh_flags_movies_again(self):
+        refresh_similar_movies()
+        baker.make(MovieRating, movie=self.movies[0], rating=5)
+        with mock.patch.object(RatingMatrix, "from_database", side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                refresh_similar_movies()
+        self.assertEqual(
+            list(Movie.objects.filter(similar_movies_stale=True).values_list("id", flat=True)),
+            [self.movies[0].id],
+        )
+        self.assertGreater(refresh_similar_movies(), 0)
+        self.assertFalse(Movie.objects.filter(similar_movies_stale=True).exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command("refresh_similar_movies", "--full", stdout=out)
+        self.assertIn("Refreshed similar movies of 5 movies", out.getvalue())
+
+
+class ExportTest(APITestCase):
+    def setUp(self):
+        self.staff = baker.make(User, is_staff=True)
+        self.movie = baker.make(Movie, name="Movie, \"quoted\"")
+        self.rating = baker.make(MovieRating, movie=self.movie, rating=4, comment="first line\nsecond line")
+
+    def export(self, url):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        url = reverse("movie:export", args=["ratings", "csv"])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(baker.make(User))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get(reverse("movie:export", args=["users", "csv"])).status_code, 404)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export(reverse("movie:export", args=["ratings", "csv"])))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["username"], self.rating.user.username)
+        self.assertEqual(rows[0]["movie_id"], str(self.movie.id))
+        self.assertEqual(rows[0]["comment"], "first line\nsecond line")
+        self.assertEqual(rows[0]["created_at"], self.rating.created_at.isoformat())
+
+        rows = list(csv.DictReader(StringIO(self.export(reverse("movie:export", args=["movies", "csv"])))))
+        self.assertEqual(rows[0]["name"], self.movie.name)
+
+    def test_jsonl(self):
+        baker.make(Movie)
+        lines = self.export(reverse("movie:export", args=["movies", "jsonl"])).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])["name"], self.movie.name)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ratings.jsonl")
+            call_command("export_data", "ratings", "--format", "jsonl", "--output", path, stderr=StringIO())
+            with open(path, encoding="utf-8") as output:
+                self.assertEqual(json.loads(output.readline())["rating"], 4)
+
+    def test_export_is_chunked(self):
+        users = User.objects.bulk_create(User(username=f"export-{i}") for i in range(100))
+        movies = Movie.objects.bulk_create(baker.prepare(Movie, _quantity=100))
+        MovieRating.objects.bulk_create(
+            MovieRating(user=user, movie=movie, rating=3, comment="x" * 50) for user in users for movie in movies
+        )
+        with mock.patch.object(export, "EXPORT_CHUNK_SIZE", 100), self.assertNumQueries(1):
+            tracemalloc.start()
+            try:
+                line_counts = [chunk.count("\n") for chunk in iter_export("ratings", "jsonl")]
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(line_counts, [100] * 100 + [1])
+        # The export takes about 1 MB, holding all of its rows at once would take several.
+        self.assertLess(peak, 1024 * 1024)
+
+
+class LoadDatasetTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(content)
+        return path
+
+    def load(self, **paths):
+        out = StringIO()
+        call_command("load_dataset", *[f"--{name}={path}" for name, path in paths.items()], stdout=out)
+        return out.getvalue()
+
+    def test_movielens(self):
+        movies = self.write(
+            "movies.csv",
+            'movieId,title,genres\n1,Toy Story (1995),Animation\n2,"Heat, Again (1995)",Action\n',
+        )
+        ratings = self.write("ratings.csv", (
+            "userId,movieId,rating,timestamp\n1,1,4.0,964982703\n1,2,0.5,964981247\n2,1,3.5,964982224\n"
+            # An unknown movie and a second rating of the same movie by the same user are skipped.
+            "2,3,5.0,964982931\n2,1,1.0,964982931\n"
+        ))
+        output = self.load(movies=movies, ratings=ratings)
+        self.assertIn("Read 5 ratings and wrote 4", output)
+        self.assertIn("rows/s", output)
+
+        movie = Movie.objects.get(id=1)
+        self.assertEqual((movie.name, movie.created_year), ("Toy Story", 1995))
+        self.assertEqual(Movie.objects.get(id=2).name, "Heat, Again")
+        self.assertEqual(MovieRating.objects.count(), 3)
+        self.assertEqual(MovieRating.objects.get(user__username="user-1", movie_id=2).rating, 1)
+        self.assertEqual((movie.rating_count, movie.rating_sum), (2, 8))
+        self.assertEqual(MovieRanking.objects.count(), 2)
+        self.assertTrue(movie.similar_movies_stale)
+
+        # Loading the same files again changes nothing.
+        self.load(movies=movies, ratings=ratings)
+        self.assertEqual(MovieRating.objects.count(), 3)
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_exported_jsonl(self):
+        movie = baker.make(Movie)
+        user = baker.make(User)
+        ratings = self.write("ratings.jsonl", "".join(
+            json.dumps(row) + "\n" for row in [
+                {"username": user.username, "movie_id": movie.id, "rating": 2, "comment": "Meh"},
+                {"username": "newcomer", "movie_id": movie.id, "rating": 4},
+            ]
+        ))
+        watchlists = self.write("watchlists.jsonl", json.dumps({"username": user.username, "movie_id": movie.id}))
+        self.load(ratings=ratings, watchlists=watchlists)
+
+        movie.refresh_from_db()
+        self.assertEqual(movie.overall_rating, 3)
+        self.assertEqual(MovieRating.objects.get(user=user).comment, "Meh")
+        self.assertFalse(User.objects.get(username="newcomer").has_usable_password())
+        self.assertEqual(get_cached_watchlist(user).movie_ids, {movie.id})
+
+    def test_conflicting_movie_ids(self):
+        movie = baker.make(Movie, name="Heat", created_year=1995)
+        movies = self.write("movies.csv", f"movieId,title\n{movie.id},Toy Story (1995)\n{movie.id + 1},Up (2009)\n")
+        with self.assertRaisesMessage(CommandError, f"Movie ids already used by other movies: {movie.id}"):
+            self.load(movies=movies)
+        self.assertEqual(Movie.objects.get().name, "Heat")
+
+        movies = self.write("movies.csv", f"movieId,title\n{movie.id},Heat (1995)\n{movie.id + 1},Up (2009)\n")
+        self.assertIn("Read 2 movies and wrote 1", self.load(movies=movies))
+        self.assertEqual(baker.make(Movie).id, movie.id + 2)
+
+    def test_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self.load(ratings=self.write("ratings.xml", ""))
+
+
+class QueryCountTest(APITestCase):
+    sizes = [1, 10, 50]
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        throttle_buckets.clear()
+        self.user = baker.make(User)
+        self.password = "something"
+        self.user.set_password(self.password)
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+        self.movie = baker.make(Movie)
+        baker.make(SecurityQuestion, user=self.user)
+
+    def seed(self, size):
+        users = baker.make(User, _quantity=size)
+        movies = baker.make(Movie, _quantity=size)
+        for user in users:
+            baker.make(MovieRating, user=user, movie=self.movie, rating=random.randint(1, 5))
+            watchlist = baker.make(MovieList, user=user, name=MovieList.WATCH_LIST_NAME)
+            watchlist.movies.set(movies)
+        watchlist, _ = MovieList.objects.get_or_create(user=self.user, name=MovieList.WATCH_LIST_NAME)
+        watchlist.movies.add(*movies)
+
+    def authenticate(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        # Warm the token cache so that the counts below cover the steady state.
+        self.client.get(reverse("movie:list"))
+
+    def assert_queries(self, num, method, url, data=None, expected_status=status.HTTP_200_OK):
+        for size in self.sizes:
+            self.seed(size)
+            with self.subTest(size=size), self.assertNumQueries(num):
+                response = getattr(self.client, method)(url, data=data)
+            self.assertEqual(response.status_code, expected_status)
+
+    def test_list_anonymous(self):
+        self.assert_queries(1, "get", reverse("movie:list"))
+
+    def test_list_authenticated(self):
+        self.authenticate()
+        self.assert_queries(2, "get", reverse("movie:list"))
+
+    def test_retrieve_anonymous(self):
+        self.assert_queries(2, "get", reverse("movie:retrieve", args=[self.movie.id]))
+
+    def test_retrieve_authenticated(self):
+        self.authenticate()
+        self.assert_queries(3, "get", reverse("movie:retrieve", args=[self.movie.id]))
+
+    def test_watchlist(self):
+        self.authenticate()
+        self.assert_queries(2, "get", reverse("movie:retrieve_watchlist"))
+
+    def test_add_and_remove_watchlist(self):
+        self.authenticate()
+        url = reverse("movie:add_to_watchlist", args=[self.movie.id])
+        for size in self.sizes:
+            self.seed(size)
+            with self.subTest(size=size), self.assertNumQueries(4):
+                response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            with self.subTest(size=size), self.assertNumQueries(3):
+                response = self.client.delete(url)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_create_rating(self):
+        self.authenticate()
+        for size in self.sizes:
+            self.seed(size)
+            movie = baker.make(Movie)
+            with self.subTest(size=size), self.assertNumQueries(7):
+                response = self.client.post(reverse("movie:create_rating", args=[movie.id]), data={"rating": 3})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_register(self):
+        for size in self.sizes:
+            self.seed(size)
+            with self.subTest(size=size), self.assertNumQueries(5):
+                response = self.client.post(
+                    reverse("user:register"),
+                    data={
+                        "username": f"user{size}",
+                        "password": "a-Strong-password",
+                        "security_question": {"question": "question", "answer": "answer"},
+                    },
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_login(self):
+        self.assert_queries(2, "post", reverse("user:login"), data={
+            "username": self.user.username,
+            "password": self.password,
+        })
+
+    def test_reset_password(self):
+        url = reverse("user:reset-password", args=[self.user.username])
+        self.assert_queries(2, "get", url)
+        # Saving the user also reads its token keys, to invalidate them in every process.
+        self.assert_queries(4, "post", url, data={
+            "answer": self.user.security_question.answer,
+            "password": "another-Strong-password",
+        })
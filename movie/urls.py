@@ -1,13 +1,31 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# The hottest endpoints have async implementations that are used when the project is served over ASGI.
+hot_views = async_views if settings.ASYNC_VIEWS else views
 
 app_name = "movie"
 
 urlpatterns = [
-    path('', views.ListMovieAPIView.as_view(), name="list"),
-    path('<int:pk>/', views.RetrieveMovieAPIView.as_view(), name="retrieve"),
+    path('', hot_views.ListMovieAPIView.as_view(), name="list"),
+    path('top/', views.ListTopMovieAPIView.as_view(), name="top"),
+    path('<int:pk>/', hot_views.RetrieveMovieAPIView.as_view(), name="retrieve"),
+    path('<int:pk>/ratings/', views.ListMovieRatingAPIView.as_view(), name="ratings"),
+    path('<int:pk>/similar/', views.ListSimilarMovieAPIView.as_view(), name="similar"),
     path('<int:pk>/rating/', views.CreateMovieRatingAPIView.as_view(), name="create_rating"),
-    path('<int:pk>/watchlist/', views.AddRemoveMovieToWatchList.as_view(), name="add_to_watchlist"),
+    path('<int:pk>/watchlist/', hot_views.AddRemoveMovieToWatchList.as_view(), name="add_to_watchlist"),
     path('watchlist/', views.RetrieveWatchList.as_view(), name="retrieve_watchlist"),
+    path('watchlist/bulk/', views.BulkUpdateWatchList.as_view(), name="bulk_update_watchlist"),
+    path('lists/', views.ListCreateMovieList.as_view(), name="lists"),
+    path('lists/membership/', views.MovieListMembership.as_view(), name="list_membership"),
+    path('lists/<int:list_id>/', views.RetrieveUpdateDestroyMovieList.as_view(), name="list_detail"),
+    path('lists/<int:list_id>/movies/', views.ListMovieListMovies.as_view(), name="list_movies"),
+    path('lists/<int:list_id>/movies/<int:pk>/', views.AddRemoveMovieToMovieList.as_view(), name="list_movie"),
 ]
+
+# Django 4.1 iterates streaming responses on the event loop under ASGI, where the export cannot query the
+# database, so exports are only served over WSGI. The export_data command works in both modes.
+if settings.SERVER_MODE != "asgi":
+    urlpatterns.append(path('export/<slug:dataset>.<slug:export_format>', views.ExportAPIView.as_view(), name="export"))
@@ -1,17 +1,153 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers, status
 from rest_framework.fields import CurrentUserDefault
-from rest_framework.generics import ListAPIView, RetrieveAPIView, CreateAPIView, GenericAPIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.generics import (
+    CreateAPIView,
+    GenericAPIView,
+    ListAPIView,
+    ListCreateAPIView,
+    RetrieveAPIView,
+    RetrieveUpdateDestroyAPIView,
+    get_object_or_404,
+)
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from movie.models import Movie, MovieRating, MovieList
-from utility.serializers import ContextDefault
+from movie.export import EXPORT_FORMATS, EXPORTS, iter_export
+from movie.filters import MovieFilterBackend, TopMovieFilterBackend
+from movie.models import (
+    RATING_STARS,
+    Movie,
+    MovieList,
+    MovieRanking,
+    MovieRating,
+    get_rating_histogram_field,
+)
+from movie.response_cache import (
+    RESPONSE_CACHE_TIMEOUT,
+    get_catalogue_version,
+    get_response_cache_key,
+    get_response_etag,
+)
+from movie.watchlist import get_cached_watchlist, invalidate_cached_watchlists
+from utility.media import get_url_builder
+from utility.pagination import KeysetPagination
+from utility.serializers import ContextDefault, SparseFieldsetSerializerMixin
+from utility.views import SparseFieldsetMixin, ValuesListMixin
 
 
-class ListMovieAPIView(ListAPIView):
-    class ListMovieSerializer(serializers.ModelSerializer):
+# Ratings embedded in the movie detail, the rest are paginated at movie:ratings.
+LATEST_RATINGS_COUNT = 10
+# Logos of the first movies of every list shown in the list index.
+LIST_PREVIEW_LOGOS = 4
+
+
+class MoviePagination(KeysetPagination):
+    ordering_fields = ["id", "director", "created_year", "length_minutes", "imdb_rating", "overall_rating"]
+
+
+class MovieRatingPagination(KeysetPagination):
+    ordering_fields = ["id"]
+
+
+class TopMoviePagination(KeysetPagination):
+    ordering_fields = ["score"]
+    default_ordering = "-score"
+    tie_breaker = "movie_id"
+
+
+class WatchlistMembershipField(serializers.ReadOnlyField):
+    def __init__(self, **kwargs):
+        kwargs["source"] = "id"
+        super().__init__(**kwargs)
+
+    def to_representation(self, movie_id):
+        return movie_id in self.context["watchlist"].movie_ids
+
+
+class ImageUrlsField(serializers.ReadOnlyField):
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        super().__init__(**kwargs)
+
+    @cached_property
+    def build_url(self):
+        return get_url_builder(Movie._meta.get_field(self.image_field).storage, self.context.get("request"))
+
+    def to_representation(self, names):
+        return [self.build_url(name) for name in names]
+
+
+class ImageVariantsField(ImageUrlsField):
+    def __init__(self, image_field, **kwargs):
+        kwargs["source"] = "image_variants"
+        super().__init__(image_field, **kwargs)
+
+    def to_representation(self, image_variants):
+        variants = []
+        for variant in image_variants.get(self.image_field, {}).get("variants", []):
+            variants.append({
+                "url": self.build_url(variant["name"]),
+                "width": variant["width"],
+                "height": variant["height"],
+                "format": variant["format"],
+            })
+        return variants
+
+
+class WatchlistContextMixin:
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        fields = context.get("fields")
+        if fields is None or "is_in_watchlist" in fields:
+            context["watchlist"] = get_cached_watchlist(self.request.user)
+        return context
+
+
+class AnonymousResponseCacheMixin:
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        version = get_catalogue_version()
+        etag = get_response_etag(version, request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = get_response_cache_key(version, request)
+            data = cache.get(cache_key)
+            if data is None:
+                response = super().get(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(cache_key, response.data, RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        elif response.status_code != status.HTTP_304_NOT_MODIFIED:
+            return response
+        return patch_response_cache_headers(response, etag)
+
+
+def patch_response_cache_headers(response, etag):
+    # No Last-Modified: its one second resolution would let If-Modified-Since miss an invalidation made in
+    # the second the response was served.
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+class ListMovieAPIView(
+    AnonymousResponseCacheMixin, WatchlistContextMixin, SparseFieldsetMixin, ValuesListMixin, ListAPIView,
+):
+    class ListMovieSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
         overall_rating = serializers.FloatField()
-        is_in_watchlist = serializers.BooleanField()
+        is_in_watchlist = WatchlistMembershipField()
+        logo_variants = ImageVariantsField("logo")
 
         class Meta:
             model = Movie
@@ -22,20 +158,56 @@ class ListMovieAPIView(ListAPIView):
                 "created_year",
                 "length_minutes",
                 "logo",
+                "logo_variants",
                 "overall_rating",
                 "imdb_rating",
                 "is_in_watchlist",
             ]
 
     serializer_class = ListMovieSerializer
+    pagination_class = MoviePagination
+    filter_backends = [MovieFilterBackend]
 
     def get_queryset(self):
-        queryset = Movie.objects.annotate_overall_rating()
-        if self.request.user.is_authenticated:
-            movie_list, _ = MovieList.objects.get_or_create(user=self.request.user, name=MovieList.WATCH_LIST_NAME)
-        else:
-            movie_list = None
-        return queryset.annotate_is_in_watchlist(movie_list)
+        return self.trim_queryset(Movie.objects.all(), self.paginator.get_ordering(self.request).lstrip("-"))
+
+
+class ListTopMovieAPIView(AnonymousResponseCacheMixin, WatchlistContextMixin, ListAPIView):
+    class TopMovieSerializer(serializers.Serializer):
+        movie = ListMovieAPIView.ListMovieSerializer()
+        score = serializers.FloatField()
+
+        def to_representation(self, ranking):
+            data = super().to_representation(ranking)
+            return {**data["movie"], "ranking_score": data["score"]}
+
+    serializer_class = TopMovieSerializer
+    pagination_class = TopMoviePagination
+    filter_backends = [TopMovieFilterBackend]
+
+    def get_queryset(self):
+        return MovieRanking.objects.select_related("movie")
+
+
+class ListSimilarMovieAPIView(AnonymousResponseCacheMixin, WatchlistContextMixin, ListAPIView):
+    class SimilarMovieSerializer(ListMovieAPIView.ListMovieSerializer):
+        similarity = serializers.FloatField()
+
+        class Meta(ListMovieAPIView.ListMovieSerializer.Meta):
+            fields = ListMovieAPIView.ListMovieSerializer.Meta.fields + ["similarity"]
+
+    serializer_class = SimilarMovieSerializer
+
+    def get_queryset(self):
+        return Movie.objects.filter(similar_to__movie_id=self.kwargs["pk"]).annotate(
+            similarity=F("similar_to__score"),
+        ).order_by("similar_to__rank")
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not response.data and not Movie.objects.filter(pk=self.kwargs["pk"]).exists():
+            raise Http404
+        return response
 
 
 class MovieRatingSerializer(serializers.ModelSerializer):
@@ -50,12 +222,15 @@ class MovieRatingSerializer(serializers.ModelSerializer):
         ]
 
 
-class RetrieveMovieAPIView(RetrieveAPIView):
-    class RetrieveMovieSerializer(serializers.ModelSerializer):
-        ratings = MovieRatingSerializer(source="movierating_set", many=True)
+class RetrieveMovieAPIView(AnonymousResponseCacheMixin, WatchlistContextMixin, SparseFieldsetMixin, RetrieveAPIView):
+    class RetrieveMovieSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+        ratings = MovieRatingSerializer(source="latest_ratings", many=True)
+        rating_histogram = serializers.DictField(child=serializers.IntegerField())
         overall_rating = serializers.FloatField()
-        can_rate = serializers.SerializerMethodField()
-        is_in_watchlist = serializers.BooleanField()
+        can_rate = serializers.BooleanField()
+        is_in_watchlist = WatchlistMembershipField()
+        logo_variants = ImageVariantsField("logo")
+        header_image_variants = ImageVariantsField("header_image")
 
         class Meta:
             model = Movie
@@ -66,30 +241,49 @@ class RetrieveMovieAPIView(RetrieveAPIView):
                 "created_year",
                 "length_minutes",
                 "logo",
+                "logo_variants",
                 "overall_rating",
+                "rating_count",
+                "rating_histogram",
                 "ratings",
                 "imdb_rating",
                 "header_image",
+                "header_image_variants",
                 "story",
                 "can_rate",
                 "is_in_watchlist",
             ]
 
-        def get_can_rate(self, movie: Movie):
-            user = self.context["request"].user
-            if not user.is_authenticated:
-                return False
-            return not movie.movierating_set.filter(user=user).exists()
-
     serializer_class = RetrieveMovieSerializer
+    field_columns = {
+        "rating_histogram": [get_rating_histogram_field(star) for star in RATING_STARS],
+    }
+
+    def get_queryset(self):
+        queryset = Movie.objects.all()
+        if self.is_field_requested("can_rate"):
+            queryset = queryset.annotate_can_rate(self.request.user)
+        return self.trim_queryset(queryset)
+
+    def get_object(self):
+        movie = super().get_object()
+        if self.is_field_requested("ratings"):
+            movie.latest_ratings = list(MovieRating.objects.newest(movie.id, LATEST_RATINGS_COUNT))
+        return movie
+
+
+class ListMovieRatingAPIView(AnonymousResponseCacheMixin, ListAPIView):
+    serializer_class = MovieRatingSerializer
+    pagination_class = MovieRatingPagination
 
     def get_queryset(self):
-        queryset = Movie.objects.annotate_overall_rating()
-        if self.request.user.is_authenticated:
-            movie_list, _ = MovieList.objects.get_or_create(user=self.request.user, name=MovieList.WATCH_LIST_NAME)
-        else:
-            movie_list = None
-        return queryset.annotate_is_in_watchlist(movie_list)
+        return MovieRating.objects.filter(movie_id=self.kwargs["pk"]).select_related("user")
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not response.data["results"] and not Movie.objects.filter(pk=self.kwargs["pk"]).exists():
+            raise Http404
+        return response
 
 
 class CreateMovieRatingAPIView(CreateAPIView):
@@ -118,10 +312,15 @@ class CreateMovieRatingAPIView(CreateAPIView):
             "movie": self.get_object(),
         }
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+
 
-class RetrieveWatchList(ListAPIView):
-    class WatchlistMovieSerializer(serializers.ModelSerializer):
+class RetrieveWatchList(SparseFieldsetMixin, ValuesListMixin, ListAPIView):
+    class WatchlistMovieSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
         overall_rating = serializers.FloatField()
+        logo_variants = ImageVariantsField("logo")
 
         class Meta:
             model = Movie
@@ -132,16 +331,23 @@ class RetrieveWatchList(ListAPIView):
                 "created_year",
                 "length_minutes",
                 "logo",
+                "logo_variants",
                 "overall_rating",
                 "imdb_rating",
             ]
 
     permission_classes = [IsAuthenticated]
     serializer_class = WatchlistMovieSerializer
+    pagination_class = MoviePagination
 
     def get_queryset(self):
-        movie_list, _ = MovieList.objects.get_or_create(user=self.request.user, name=MovieList.WATCH_LIST_NAME)
-        return movie_list.movies.all().annotate_overall_rating()
+        watchlist = get_cached_watchlist(self.request.user)
+        if watchlist.id is None:
+            return Movie.objects.none()
+        return self.trim_queryset(
+            Movie.objects.filter(movielist=watchlist.id),
+            self.paginator.get_ordering(self.request).lstrip("-"),
+        )
 
 
 class AddRemoveMovieToWatchList(GenericAPIView):
@@ -149,13 +355,198 @@ class AddRemoveMovieToWatchList(GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        movie_list, _ = MovieList.objects.get_or_create(user=self.request.user, name=MovieList.WATCH_LIST_NAME)
+        movie_list, _ = MovieList.get_watchlist(self.request.user)
         movie = self.get_object()
         movie_list.movies.add(movie)
         return Response(status=status.HTTP_201_CREATED)
 
     def delete(self, request, *args, **kwargs):
-        movie_list, _ = MovieList.objects.get_or_create(user=self.request.user, name=MovieList.WATCH_LIST_NAME)
+        movie_list, _ = MovieList.get_watchlist(self.request.user)
         movie = self.get_object()
         movie_list.movies.remove(movie)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BulkUpdateWatchList(GenericAPIView):
+    class BulkUpdateWatchListSerializer(serializers.Serializer):
+        MAX_MOVIES = 500
+
+        add = serializers.ListField(child=serializers.IntegerField(), default=list)
+        remove = serializers.ListField(child=serializers.IntegerField(), default=list)
+
+        def validate(self, attrs):
+            attrs["add"] = list(dict.fromkeys(attrs["add"]))
+            attrs["remove"] = list(dict.fromkeys(attrs["remove"]))
+            if len(attrs["add"]) + len(attrs["remove"]) > self.MAX_MOVIES:
+                raise serializers.ValidationError(_("At most %d movies can be changed at once.") % self.MAX_MOVIES)
+            if set(attrs["add"]) & set(attrs["remove"]):
+                raise serializers.ValidationError(_("A movie can not be both added and removed."))
+            return attrs
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkUpdateWatchListSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add, remove = serializer.validated_data["add"], serializer.validated_data["remove"]
+        through = MovieList.movies.through
+
+        # Bulk writes to the through table do not send m2m_changed, so the cached watchlist is invalidated here.
+        with transaction.atomic():
+            movie_list = MovieList.get_watchlist(request.user)[0]
+            in_watchlist = dict(
+                Movie.objects.filter(id__in=add + remove).annotate(
+                    in_watchlist=Exists(through.objects.filter(movielist=movie_list, movie=OuterRef("pk"))),
+                ).values_list("id", "in_watchlist"),
+            )
+            added = [movie_id for movie_id in add if in_watchlist.get(movie_id) is False]
+            removed = [movie_id for movie_id in remove if in_watchlist.get(movie_id)]
+            if added:
+                through.objects.bulk_create(
+                    [through(movielist=movie_list, movie_id=movie_id) for movie_id in added],
+                    ignore_conflicts=True,
+                )
+            if removed:
+                through.objects.filter(movielist=movie_list, movie_id__in=removed).delete()
+        if added or removed:
+            invalidate_cached_watchlists([request.user.id])
+
+        def get_results(movie_ids, changed, changed_result):
+            results = []
+            for movie_id in movie_ids:
+                if movie_id not in in_watchlist:
+                    result = "not_found"
+                elif movie_id in changed:
+                    result = changed_result
+                else:
+                    result = "unchanged"
+                results.append({"id": movie_id, "result": result})
+            return results
+
+        return Response({
+            "add": get_results(add, set(added), "added"),
+            "remove": get_results(remove, set(removed), "removed"),
+        })
+
+
+class MovieListSerializer(serializers.ModelSerializer):
+    user = serializers.HiddenField(default=CurrentUserDefault())
+    movie_count = serializers.IntegerField(read_only=True)
+    logos = ImageUrlsField("logo")
+
+    class Meta:
+        model = MovieList
+        fields = [
+            "id",
+            "user",
+            "name",
+            "movie_count",
+            "logos",
+        ]
+
+    def validate_name(self, name):
+        is_watchlist = self.instance is not None and self.instance.name == MovieList.WATCH_LIST_NAME
+        if is_watchlist and name != MovieList.WATCH_LIST_NAME:
+            raise serializers.ValidationError(_("The watch list can not be renamed."))
+        if not is_watchlist and name == MovieList.WATCH_LIST_NAME:
+            raise serializers.ValidationError(_("This name is reserved for the watch list."))
+        return name
+
+
+class UserMovieListMixin:
+    permission_classes = [IsAuthenticated]
+    serializer_class = MovieListSerializer
+    lookup_url_kwarg = "list_id"
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return MovieList.objects.none()
+        return MovieList.objects.filter(user=self.request.user).annotate_summary(LIST_PREVIEW_LOGOS).order_by("id")
+
+
+class ListCreateMovieList(UserMovieListMixin, ListCreateAPIView):
+    def perform_create(self, serializer):
+        movie_list = serializer.save()
+        movie_list.movie_count, movie_list.logos = 0, []
+
+
+class RetrieveUpdateDestroyMovieList(UserMovieListMixin, RetrieveUpdateDestroyAPIView):
+    def perform_destroy(self, instance):
+        if instance.name == MovieList.WATCH_LIST_NAME:
+            raise serializers.ValidationError(_("The watch list can not be deleted."))
+        instance.delete()
+
+
+class ListMovieListMovies(RetrieveWatchList):
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Movie.objects.none()
+        return self.trim_queryset(
+            Movie.objects.filter(movielist=self.kwargs["list_id"], movielist__user=self.request.user),
+            self.paginator.get_ordering(self.request).lstrip("-"),
+        )
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not response.data["results"] and not MovieList.objects.filter(
+            id=self.kwargs["list_id"], user=request.user,
+        ).exists():
+            raise Http404
+        return response
+
+
+class AddRemoveMovieToMovieList(GenericAPIView):
+    queryset = Movie.objects.all()
+    permission_classes = [IsAuthenticated]
+
+    def get_movie_list(self):
+        return get_object_or_404(MovieList.objects.filter(user=self.request.user), id=self.kwargs["list_id"])
+
+    def post(self, request, *args, **kwargs):
+        self.get_movie_list().movies.add(self.get_object())
+        return Response(status=status.HTTP_201_CREATED)
+
+    def delete(self, request, *args, **kwargs):
+        self.get_movie_list().movies.remove(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MovieListMembership(GenericAPIView):
+    class MovieListMembershipSerializer(serializers.Serializer):
+        ids = serializers.ListField(
+            child=serializers.IntegerField(),
+            min_length=1,
+            max_length=MoviePagination.max_page_size,
+        )
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = MovieListMembershipSerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        list_ids = {movie_id: [] for movie_id in serializer.validated_data["ids"]}
+        # One lookup of the (movie_id, movielist_id) index for the whole page, whatever the number of lists.
+        rows = MovieList.movies.through.objects.filter(
+            movielist__user=request.user, movie_id__in=list(list_ids),
+        ).values_list("movie_id", "movielist_id")
+        for movie_id, list_id in rows:
+            list_ids[movie_id].append(list_id)
+        return Response({
+            "results": [{"id": movie_id, "lists": sorted(ids)} for movie_id, ids in list_ids.items()],
+        })
+
+
+class ExportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, dataset, export_format, *args, **kwargs):
+        if dataset not in EXPORTS or export_format not in EXPORT_FORMATS:
+            raise Http404
+        response = StreamingHttpResponse(
+            iter_export(dataset, export_format),
+            content_type=f"{EXPORT_FORMATS[export_format]}; charset=utf-8",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{dataset}.{export_format}"'
+        return response
@@ -0,0 +1,64 @@
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from movie.models import MovieList
+
+Watchlist = namedtuple("Watchlist", ["id", "movie_ids"])
+
+EMPTY_WATCHLIST = Watchlist(id=None, movie_ids=frozenset())
+WATCHLIST_CACHE_TIMEOUT = 60 * 60
+
+
+def get_watchlist_cache_key(user_id):
+    return f"movie:watchlist:{user_id}"
+
+
+def get_cached_watchlist(user) -> Watchlist:
+    if not user.is_authenticated:
+        return EMPTY_WATCHLIST
+    key = get_watchlist_cache_key(user.id)
+    watchlist = cache.get(key)
+    if watchlist is None:
+        watchlist = make_watchlist(list(get_watchlist_rows(user)))
+        cache.set(key, watchlist, WATCHLIST_CACHE_TIMEOUT)
+    return watchlist
+
+
+async def aget_cached_watchlist(user) -> Watchlist:
+    if not user.is_authenticated:
+        return EMPTY_WATCHLIST
+    key = get_watchlist_cache_key(user.id)
+    watchlist = await cache.aget(key)
+    if watchlist is None:
+        watchlist = make_watchlist([row async for row in get_watchlist_rows(user)])
+        await cache.aset(key, watchlist, WATCHLIST_CACHE_TIMEOUT)
+    return watchlist
+
+
+def get_watchlist_rows(user):
+    return MovieList.objects.filter(user=user, name=MovieList.WATCH_LIST_NAME).values_list("id", "movies")
+
+
+def make_watchlist(rows):
+    if not rows:
+        return EMPTY_WATCHLIST
+    movie_ids = frozenset(movie_id for _, movie_id in rows if movie_id is not None)
+    return Watchlist(id=rows[0][0], movie_ids=movie_ids)
+
+
+def invalidate_cached_watchlists(user_ids):
+    cache.delete_many([get_watchlist_cache_key(user_id) for user_id in user_ids])
+
+
+def invalidate_cached_watchlists_on_commit(user_ids):
+    # Invalidate right away and once more after commit, so that a request racing the transaction cannot
+    # cache the watchlist as it was before the change.
+    user_ids = list(user_ids)
+    invalidate_cached_watchlists(user_ids)
+    transaction.on_commit(lambda: invalidate_cached_watchlists(user_ids))
+
+
+async def ainvalidate_cached_watchlists(user_ids):
+    await cache.adelete_many([get_watchlist_cache_key(user_id) for user_id in user_ids])
@@ -1,20 +1,33 @@
 import random
 import string
+from unittest import mock
 
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from model_bakery import baker
 from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
 from user.models import SecurityQuestion
+from user.views import ResetPasswordAPIView
+from utility.authentication import get_token_generation_key, token_cache
+from utility.cache import version_cache
+from utility.throttling import throttle_buckets
 
 
 def make_strong_password():
     return "".join(random.choices(string.ascii_letters, k=8))
 
 class RegisterAPITest(APITestCase):
+    def setUp(self):
+        throttle_buckets.clear()
+
     def make_request(self, username, password, security_question, security_answer):
         return self.client.post(
             reverse("user:register"),
@@ -51,6 +64,7 @@ class RegisterAPITest(APITestCase):
 class LoginAPITest(APITestCase):
 
     def setUp(self):
+        throttle_buckets.clear()
         self.user = baker.make(User)
         self.password = "something"
         self.user.set_password(self.password)
@@ -74,6 +88,7 @@ class LoginAPITest(APITestCase):
 
 class ChangePasswordAPITest(APITestCase):
     def setUp(self):
+        throttle_buckets.clear()
         self.user = baker.make(User)
         self.password = "something"
         self.user.set_password(self.password)
@@ -126,3 +141,148 @@ class ChangePasswordAPITest(APITestCase):
     def test_get_no_user(self):
         response = self.make_get_request("something")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        version_cache.clear()
+        token_cache.clear()
+        throttle_buckets.clear()
+        self.user = baker.make(User)
+        self.password = "something"
+        self.user.set_password(self.password)
+        self.user.save()
+        self.security_question = baker.make(SecurityQuestion, user=self.user)
+        self.token = Token.objects.create(user=self.user)
+
+    def make_request(self, token=None):
+        token = token or self.token
+        return self.client.post(reverse("user:logout"), HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def count_queries(self, requests):
+        with CaptureQueriesContext(connection) as context:
+            for _ in range(requests):
+                response = self.client.get(
+                    reverse("user:reset-password", args=[self.user.username]),
+                    HTTP_AUTHORIZATION=f"Token {self.token.key}",
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def test_query_reduction(self):
+        with mock.patch.object(ResetPasswordAPIView, "authentication_classes", [TokenAuthentication]):
+            uncached = self.count_queries(20)
+        cached = self.count_queries(20)
+        # The view itself runs two queries per request, the uncached authentication one more.
+        self.assertEqual(uncached, 20 * 3)
+        self.assertEqual(cached, 20 * 2 + 1)
+
+    def test_logout(self):
+        self.count_queries(1)
+        response = self.make_request()
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(self.make_request().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_regenerated_token(self):
+        self.count_queries(1)
+        self.token.delete()
+        new_token = Token.objects.create(user=self.user)
+        self.assertEqual(self.make_request().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.make_request(new_token).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_password_change(self):
+        self.count_queries(1)
+        self.assertEqual(len(token_cache), 1)
+        response = self.client.post(
+            reverse("user:reset-password", args=[self.user.username]),
+            data={"answer": self.security_question.answer, "password": make_strong_password()},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(token_cache), 0)
+
+    def test_invalidation_by_other_process(self):
+        self.count_queries(1)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        # Another process invalidates through the shared cache only, the local entry stays.
+        version_cache.set(get_token_generation_key(self.token.key), "other process")
+        self.assertEqual(len(token_cache), 1)
+        self.assertEqual(self.make_request().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user(self):
+        self.count_queries(1)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.make_request().status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AuthThrottleTest(APITestCase):
+    attempts = 30
+
+    def setUp(self):
+        throttle_buckets.clear()
+        self.user = baker.make(User, username="victim")
+        self.user.set_password("secret")
+        self.user.save()
+        self.security_question = baker.make(SecurityQuestion, user=self.user)
+
+    def flood(self, make_request):
+        count_hashes = mock.patch.object(
+            PBKDF2PasswordHasher, "encode", autospec=True, side_effect=PBKDF2PasswordHasher.encode,
+        )
+        with count_hashes as encode:
+            responses = [make_request(i) for i in range(self.attempts)]
+        return encode.call_count, [response.status_code for response in responses]
+
+    def login(self, i, **extra):
+        data = {"username": "victim", "password": f"guess-{i}"}
+        return self.client.post(reverse("user:login"), data=data, **extra)
+
+    @override_settings(AUTH_THROTTLE_RATES={"ip": "5/min"})
+    def test_login_flood_from_one_address(self):
+        hashes, status_codes = self.flood(self.login)
+        self.assertEqual(hashes, 5)
+        self.assertEqual(status_codes.count(status.HTTP_429_TOO_MANY_REQUESTS), self.attempts - 5)
+        response = self.login(0)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+
+    @override_settings(AUTH_THROTTLE_RATES={"ip": "5/min", "username": "3/min"})
+    def test_login_flood_from_many_addresses(self):
+        hashes, status_codes = self.flood(lambda i: self.login(i, REMOTE_ADDR=f"10.0.0.{i}"))
+        self.assertEqual(hashes, 3)
+        self.assertEqual(status_codes.count(status.HTTP_429_TOO_MANY_REQUESTS), self.attempts - 3)
+
+    @override_settings(AUTH_THROTTLE_RATES={"ip": "5/min"})
+    def test_register_and_reset_password_floods(self):
+        def register(i):
+            return self.client.post(reverse("user:register"), data={
+                "username": f"user-{i}",
+                "password": make_strong_password(),
+                "security_question": {"question": "question", "answer": "answer"},
+            })
+
+        def reset_password(i):
+            return self.client.post(
+                reverse("user:reset-password", args=["victim"]),
+                data={"answer": self.security_question.answer, "password": make_strong_password()},
+            )
+
+        for make_request in [register, reset_password]:
+            throttle_buckets.clear()
+            hashes, status_codes = self.flood(make_request)
+            self.assertEqual(hashes, 5)
+            self.assertEqual(status_codes.count(status.HTTP_429_TOO_MANY_REQUESTS), self.attempts - 5)
+        response = self.client.get(reverse("user:reset-password", args=["victim"]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(AUTH_THROTTLE_RATES={"ip": "6/min"})
+    def test_tokens_refill(self):
+        now = 1000.0
+        with mock.patch("utility.throttling.time.monotonic", side_effect=lambda: now):
+            for i in range(6):
+                self.assertNotEqual(self.login(i).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(self.login(0).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            now += 10
+            self.assertNotEqual(self.login(0).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(self.login(0).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
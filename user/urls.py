@@ -1,4 +1,3 @@
-import rest_framework.authtoken.views
 from django.urls import path
 
 from . import views
@@ -7,6 +6,7 @@ app_name = 'user'
 
 urlpatterns = [
     path('register/', views.RegisterAPIView.as_view(), name='register'),
-    path('login/', rest_framework.authtoken.views.obtain_auth_token, name='login'),
+    path('login/', views.LoginAPIView.as_view(), name='login'),
+    path('logout/', views.LogoutAPIView.as_view(), name='logout'),
     path('reset-password/<str:username>/', views.ResetPasswordAPIView.as_view(), name='reset-password'),
 ]
@@ -1,14 +1,18 @@
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.db import transaction
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import get_error_detail
 from rest_framework.generics import CreateAPIView, GenericAPIView, get_object_or_404
+from rest_framework.permissions import IsAuthenticated
 from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from user.models import SecurityQuestion
+from utility.throttling import IPThrottle, UsernameThrottle
 
 
 class SecurityQuestionSerializer(serializers.ModelSerializer):
@@ -75,11 +79,17 @@ class ResetPasswordSerializer(serializers.Serializer):
 
 class RegisterAPIView(CreateAPIView):
     serializer_class = RegisterSerializer
+    throttle_classes = [IPThrottle, UsernameThrottle]
+
+
+class LoginAPIView(ObtainAuthToken):
+    throttle_classes = [IPThrottle, UsernameThrottle]
 
 
 class ResetPasswordAPIView(GenericAPIView):
     queryset = User.objects.all()
     lookup_field = 'username'
+    throttle_classes = [IPThrottle, UsernameThrottle]
 
     def get_serializer_class(self):
         if self.request.method == "GET":
@@ -103,3 +113,11 @@ class ResetPasswordAPIView(GenericAPIView):
         user.set_password(serializer.validated_data['password'])
         user.save()
         return Response()
+
+
+class LogoutAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        request.auth.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,64 @@
+import copy
+import uuid
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from utility.cache import LRUCache, version_cache
+from utility.metrics import measure
+
+token_cache = LRUCache(
+    max_entries=settings.AUTH_TOKEN_CACHE_MAX_ENTRIES,
+    timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT,
+)
+
+
+def get_token_generation_key(key):
+    return f"auth:token-generation:{key}"
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that keeps resolved tokens in a per-process LRU cache, so authenticated requests do
+    not join Token and User every time. Failed lookups are never cached.
+
+    Every entry remembers the generation of its token in the shared Django cache, which invalidation
+    replaces, so entries of tokens invalidated by another process are dropped on their next use.
+    """
+
+    def authenticate(self, request):
+        with measure("auth"):
+            return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        # The generation is read before the database, so an invalidation during the lookup is not missed.
+        generation = version_cache.get(get_token_generation_key(key))
+        cached = token_cache.get(key)
+        if cached is None or cached[2] != generation:
+            user, token = super().authenticate_credentials(key)
+            cached = (user, token, generation)
+            token_cache.set(key, cached)
+        user, token, _ = cached
+        return copy.copy(user), token
+
+
+def invalidate_tokens(keys):
+    keys = list(keys)
+    for key in keys:
+        token_cache.delete(key)
+    # The generations outlive every entry cached before the invalidation.
+    generation = uuid.uuid4().hex
+    version_cache.set_many(
+        {get_token_generation_key(key): generation for key in keys},
+        settings.AUTH_TOKEN_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_token(key):
+    invalidate_tokens([key])
+
+
+def invalidate_user_tokens(user_id):
+    token_cache.delete_matching(lambda cached: cached[0].pk == user_id)
+    invalidate_tokens(Token.objects.filter(user_id=user_id).values_list("key", flat=True))
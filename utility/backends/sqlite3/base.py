@@ -0,0 +1,31 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = {"DEFERRED", "IMMEDIATE", "EXCLUSIVE"}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend that runs `OPTIONS["pragmas"]` on every new connection and opens transactions with
+    `BEGIN <OPTIONS["transaction_mode"]>`. With IMMEDIATE a transaction that reads before it writes takes
+    the write lock up front and waits for busy_timeout, instead of failing with "database is locked" when
+    another writer commits between its read and its write.
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pragmas", None)
+        transaction_mode = params.pop("transaction_mode", None)
+        if transaction_mode is not None and transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"Unknown SQLite transaction_mode {transaction_mode!r}.")
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict["OPTIONS"].get("pragmas", {}).items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        transaction_mode = self.settings_dict["OPTIONS"].get("transaction_mode")
+        self.cursor().execute(f"BEGIN {transaction_mode}" if transaction_mode else "BEGIN")
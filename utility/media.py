@@ -0,0 +1,161 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+# Image variants are named `<stem>.<width>w.<content hash>.<extension>`, so their content never changes.
+CONTENT_ADDRESSED_PATTERN = re.compile(r"\.(?P<hash>[0-9a-f]{16})\.\w+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+RANGE_PATTERN = re.compile(r"^bytes=(?P<start>\d*)-(?P<end>\d*)$")
+
+
+class FileRange:
+    """
+    File-like view of `length` bytes of `file` starting at `start`. It deliberately has no `fileno()`:
+    gunicorn's sendfile path always starts at the beginning of the file, so partial responses are streamed
+    by the worker and only full responses are handed to `os.sendfile`.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_etag(path, stat):
+    match = CONTENT_ADDRESSED_PATTERN.search(path)
+    if match:
+        return f'"{match["hash"]}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Return the `(start, length)` of a single `bytes=` range, `None` when the header should be ignored and
+    `False` when the range cannot be satisfied.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None or (not match["start"] and not match["end"]):
+        return None
+    if not match["start"]:
+        length = min(int(match["end"]), size)
+        return (size - length, length) if length else False
+    start = int(match["start"])
+    end = min(int(match["end"]), size - 1) if match["end"] else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+
+@require_safe
+def serve(request, path, document_root=None):
+    try:
+        full_path = safe_join(document_root or settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = get_etag(path, stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        mode = settings.MEDIA_SERVE_MODE
+        if mode == "x-accel-redirect":
+            response = HttpResponse()
+            response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_LOCATION + quote(path)
+        elif mode == "x-sendfile":
+            response = HttpResponse()
+            response["X-Sendfile"] = full_path
+        else:
+            response = serve_file(request, full_path, stat.st_size, etag)
+        content_type, encoding = mimetypes.guess_type(full_path)
+        response["Content-Type"] = content_type or "application/octet-stream"
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if CONTENT_ADDRESSED_PATTERN.search(path):
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response["Cache-Control"] = DEFAULT_CACHE_CONTROL
+    return response
+
+
+def serve_file(request, full_path, size, etag):
+    byte_range = None
+    if "HTTP_RANGE" in request.META and request.META.get("HTTP_IF_RANGE", etag) == etag:
+        byte_range = parse_range(request.META["HTTP_RANGE"], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    file = open(full_path, "rb")
+    if byte_range is None:
+        response = FileResponse(file)
+        response["Content-Length"] = size
+    else:
+        start, length = byte_range
+        response = FileResponse(FileRange(file, start, length), status=206)
+        response["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+        response["Content-Length"] = length
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def get_url_builder(storage, request=None):
+    """
+    Return a function that maps stored file names to `request.build_absolute_uri(storage.url(name))`, or to
+    `storage.url(name)` without a request. For file system storages under an absolute path it prepends a
+    prefix computed once, which skips the two URL parses per file. Names with dot or empty segments, which
+    `urljoin()` would resolve, take the slow path.
+    """
+    def build_url(name):
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    if not isinstance(storage, FileSystemStorage) or storage.url.__func__ is not FileSystemStorage.url:
+        return build_url
+    base_url = storage.base_url
+    if (
+        not base_url
+        or not base_url.startswith("/")
+        or base_url.startswith("//")
+        or not base_url.endswith("/")
+    ):
+        return build_url
+    prefix = build_url("")
+
+    def build_url_from_prefix(name):
+        path = filepath_to_uri(name).lstrip("/")
+        if "//" in path or "." in path and {".", ".."} & set(path.split("/")):
+            return build_url(name)
+        return prefix + path
+    return build_url_from_prefix
@@ -0,0 +1,342 @@
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import LazyObject, empty
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+PHASES = ("view", "db", "auth", "render")
+UNMATCHED_VIEW = "<unmatched>"
+# Any other method is counted as OTHER, clients must not be able to create series at will.
+METHODS = frozenset(["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE"])
+OTHER_METHOD = "OTHER"
+SNAPSHOT_INTERVAL = 1
+
+# Timings of the request being handled, None when it is not sampled. Context variables follow the request
+# into the threads of sync_to_async, so queries of async views are attributed as well.
+request_timings = ContextVar("request_timings", default=None)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values):
+    return ",".join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """
+    Prometheus histogram kept in process memory. Observations only touch the bucket they fall in, buckets
+    are accumulated when the metrics are collected.
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self):
+        """
+        Return a copy of the series of this process, as bucket counts and sum by label values.
+        """
+        with self.lock:
+            return {label_values: (list(counts), total) for label_values, (counts, total) in self.series.items()}
+
+    def collect(self, series=None):
+        """
+        Yield the lines of the text format of `series`, by default of the series of this process.
+        """
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total) in sorted((self.snapshot() if series is None else series).items()):
+            labels = format_labels(self.label_names, label_values)
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{labels}}} {total}"
+            yield f"{self.name}_count{{{labels}}} {cumulative}"
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time from the request entering the middleware to the response leaving it, of sampled requests.",
+    ("view", "method", "status"),
+    DURATION_BUCKETS,
+)
+phase_duration = Histogram(
+    "http_request_phase_duration_seconds",
+    "Time spent in the view (including auth and SQL), in SQL, in authentication and in rendering.",
+    ("view", "method", "phase"),
+    DURATION_BUCKETS,
+)
+query_count = Histogram(
+    "http_request_db_queries",
+    "Number of SQL queries per sampled request.",
+    ("view", "method"),
+    QUERY_COUNT_BUCKETS,
+)
+HISTOGRAMS = [request_duration, phase_duration, query_count]
+
+
+class SnapshotDirectory:
+    """
+    Shares the histograms of the worker processes through METRICS_DIR, like the multiprocess mode of
+    prometheus_client. Every process replaces its own file with its series at most once per
+    SNAPSHOT_INTERVAL after recording requests, and `read()` sums the files of all processes. Files of
+    workers that exited are kept, so the histograms stay cumulative until the directory is emptied when the
+    server starts.
+    """
+
+    def __init__(self):
+        self.written_at = None
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def write(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            delay = 0 if force or self.written_at is None else self.written_at + SNAPSHOT_INTERVAL - now
+            if delay > 0:
+                # The requests of the interval are written when it ends, even if no other request follows.
+                if self.timer is None:
+                    self.timer = threading.Timer(delay, self.write)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+            self.written_at = now
+            self.timer = None
+            path = os.path.join(settings.METRICS_DIR, f"histograms-{os.getpid()}.json")
+            # Label values and series are tuples, which JSON writes as lists.
+            data = {histogram.name: list(histogram.snapshot().items()) for histogram in HISTOGRAMS}
+            try:
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                    json.dump(data, file)
+                os.replace(f"{path}.tmp", path)
+            except OSError:
+                logger.exception("Could not write the metrics of this worker to %s", path)
+
+    def read(self):
+        """
+        Return the series of all processes summed, by histogram name.
+        """
+        self.write(force=True)
+        merged = {histogram.name: {} for histogram in HISTOGRAMS}
+        for path in glob.glob(os.path.join(glob.escape(settings.METRICS_DIR), "histograms-*.json")):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                logger.exception("Could not read the metrics in %s", path)
+                continue
+            for name, series in data.items():
+                for label_values, (counts, total) in series:
+                    label_values = tuple(label_values)
+                    merged_counts, merged_total = merged[name].get(label_values, ([0] * len(counts), 0.0))
+                    merged[name][label_values] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+        return merged
+
+
+snapshots = SnapshotDirectory()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.view_started = None
+        self.render_started = None
+
+    def add(self, phase, started):
+        self.durations[phase] += time.perf_counter() - started
+
+
+@contextmanager
+def measure(phase):
+    """
+    Add the time spent in the block to `phase` of the current request, if it is sampled.
+    """
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, started)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = request_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", started)
+        timings.queries += 1
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def is_staff_request(request):
+    user = getattr(request, "user", None)
+    # A user that authentication did not resolve is left alone, resolving it would query the database.
+    if isinstance(user, LazyObject) and user._wrapped is empty:
+        return False
+    return getattr(user, "is_staff", False)
+
+
+class MetricsMiddleware:
+    """
+    Times a share of METRICS_SAMPLE_RATE of the requests: in total, in the view, in SQL, in authentication
+    and in rendering. The timings are aggregated by URL name into the histograms served by `serve()`, and
+    sent in a Server-Timing header to staff users, or to everyone with METRICS_PUBLIC_SERVER_TIMING.
+    Requests that are not sampled only cost a random number.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.METRICS_SAMPLE_RATE
+        self.public_server_timing = settings.METRICS_PUBLIC_SERVER_TIMING
+        self.snapshot_directory = settings.METRICS_DIR
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # Coroutine hooks are called on the event loop, sync ones would each cost a hop to a thread.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def is_sampled(self):
+        return self.sample_rate >= 1 or self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+        # Connections opened before this module was imported missed connection_created.
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+        started = time.perf_counter()
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.record(request, response, timings, started)
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+        started = time.perf_counter()
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.record(request, response, timings, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = request_timings.get()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timings = request_timings.get()
+        if timings is not None and timings.view_started is not None:
+            timings.add("view", timings.view_started)
+            timings.view_started = None
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda response: timings.add("render", timings.render_started))
+        return response
+
+    async def aprocess_view(self, *args):
+        return MetricsMiddleware.process_view(self, *args)
+
+    async def aprocess_template_response(self, request, response):
+        return MetricsMiddleware.process_template_response(self, request, response)
+
+    def record(self, request, response, timings, started):
+        ended = time.perf_counter()
+        if timings.view_started is not None:
+            timings.add("view", timings.view_started)
+        total = ended - started
+        match = request.resolver_match
+        view = match.view_name if match is not None else UNMATCHED_VIEW
+        method = request.method if request.method in METHODS else OTHER_METHOD
+        request_duration.observe((view, method, response.status_code), total)
+        for phase, duration in timings.durations.items():
+            phase_duration.observe((view, method, phase), duration)
+        query_count.observe((view, method), timings.queries)
+        if self.snapshot_directory:
+            snapshots.write()
+
+        if self.public_server_timing or is_staff_request(request):
+            response["Server-Timing"] = ", ".join([
+                f"total;dur={total * 1000:.1f}",
+                *(
+                    f"{phase};dur={duration * 1000:.1f}"
+                    + (f';desc="{timings.queries} queries"' if phase == "db" else "")
+                    for phase, duration in timings.durations.items()
+                ),
+            ])
+        return response
+
+
+def serve(request):
+    """
+    Serve the histograms in the Prometheus text format to requests with the bearer token METRICS_TOKEN, and
+    nothing without one. With METRICS_DIR, the histograms of all worker processes are summed. Without it
+    they only cover the worker that answered, which is only accurate with a single worker.
+    """
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=404)
+    if not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse(status=401)
+    series = snapshots.read() if settings.METRICS_DIR else {}
+    lines = [line for histogram in HISTOGRAMS for line in histogram.collect(series.get(histogram.name))]
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,258 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks past the last row of the previous page instead of using OFFSET.
+    `id` breaks ties so that non-unique and nullable ordering fields get stable cursors. Pages can hold
+    model instances or `.values()` rows that include the ordering fields.
+    """
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering_fields = ["id"]
+    default_ordering = "-id"
+    tie_breaker = "id"
+    invalid_cursor_message = _("Invalid cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([instance async for instance in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor["reverse"]
+
+        queryset = queryset.order_by(*self.get_order_by(queryset, reverse))
+        if self.cursor is not None:
+            self.cursor["value"] = self.clean_cursor_value(queryset, self.cursor["value"])
+            queryset = queryset.filter(
+                self.get_seek_filter(queryset, self.cursor["value"], self.cursor["id"], reverse),
+            )
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        cursor = self.cursor
+        reverse = cursor is not None and cursor["reverse"]
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip("-") not in self.ordering_fields:
+            raise ValidationError({
+                self.ordering_query_param: [
+                    _("Ordering must be one of: %s") % ", ".join(self.ordering_fields),
+                ],
+            })
+        return ordering
+
+    @property
+    def ordering_field(self):
+        return self.ordering.lstrip("-")
+
+    @property
+    def descending(self):
+        return self.ordering.startswith("-")
+
+    def get_model_field(self, queryset, field_name):
+        model = queryset.model
+        *relations, name = field_name.split("__")
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
+    def is_nullable(self, queryset, field_name):
+        return self.get_model_field(queryset, field_name).null
+
+    def clean_cursor_value(self, queryset, value):
+        if value is None or self.ordering_field == self.tie_breaker:
+            return value
+        try:
+            return self.get_model_field(queryset, self.ordering_field).to_python(value)
+        except DjangoValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_order_by(self, queryset, reverse):
+        descending = self.descending != reverse
+        tie_breaker = F(self.tie_breaker).desc() if descending else F(self.tie_breaker).asc()
+        if self.ordering_field == self.tie_breaker:
+            return [tie_breaker]
+        field = F(self.ordering_field)
+        if self.is_nullable(queryset, self.ordering_field):
+            field = field.desc(nulls_last=True) if descending else field.asc(nulls_first=True)
+        else:
+            field = field.desc() if descending else field.asc()
+        return [field, tie_breaker]
+
+    def get_seek_filter(self, queryset, value, last_id, reverse):
+        descending = self.descending != reverse
+        before, beyond = ("lt", "lte") if descending else ("gt", "gte")
+        tie_breaker = Q(**{f"{self.tie_breaker}__{before}": last_id})
+        if self.ordering_field == self.tie_breaker:
+            return tie_breaker
+
+        field = self.ordering_field
+        is_null = Q(**{f"{field}__isnull": True})
+        if value is None:
+            # Nulls come last in descending order and first in ascending order.
+            return is_null & tie_breaker if descending else (is_null & tie_breaker) | ~is_null
+        seek = Q(**{f"{field}__{beyond}": value}) & (Q(**{f"{field}__{before}": value}) | tie_breaker)
+        if descending and self.is_nullable(queryset, field):
+            seek |= is_null
+        return seek
+
+    def get_position(self, instance):
+        if isinstance(instance, dict):
+            return instance[self.ordering_field]
+        value = instance
+        for attribute in self.ordering_field.split("__"):
+            value = getattr(value, attribute)
+            if value is None:
+                break
+        return value
+
+    def get_tie_breaker(self, instance):
+        if isinstance(instance, dict):
+            return instance[self.tie_breaker]
+        return getattr(instance, self.tie_breaker)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        payload = [self.ordering, self.get_position(instance), self.get_tie_breaker(instance), reverse]
+        cursor = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            ordering, value, last_id, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or not is_cursor_id(last_id) or not is_cursor_value(value):
+            raise NotFound(self.invalid_cursor_message)
+        return {"value": value, "id": last_id, "reverse": bool(reverse)}
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, "coreapi must be installed to use `get_schema_fields()`"
+        assert coreschema is not None, "coreschema must be installed to use `get_schema_fields()`"
+        return [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.String(title="Cursor", description="The pagination cursor value."),
+            ),
+            coreapi.Field(
+                name=self.ordering_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.Enum(
+                    [prefix + field for field in self.ordering_fields for prefix in ("", "-")],
+                    title="Ordering",
+                    description="Which field to use when ordering the results.",
+                ),
+            ),
+            coreapi.Field(
+                name=self.page_size_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.Integer(title="Page size", description="Number of results to return per page."),
+            ),
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.ordering_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Which field to use when ordering the results.",
+                "schema": {"type": "string", "enum": [p + f for f in self.ordering_fields for p in ("", "-")]},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+
+def is_cursor_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_cursor_value(value):
+    return value is None or isinstance(value, (int, float, str)) and not isinstance(value, bool)
@@ -1,3 +1,9 @@
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from utility.media import get_url_builder
+
+
 class ContextDefault:
     requires_context = True
 
@@ -6,3 +12,62 @@ class ContextDefault:
 
     def __call__(self, serializer_field):
         return serializer_field.context[self.field]
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Keeps only the fields named in the "fields" entry of the context, which `SparseFieldsetMixin` views set
+    from the query string. Nested serializers without the mixin are not trimmed.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get("fields")
+        if selected is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in selected}
+
+
+class ValuesRepresentation:
+    """
+    Builds the representation of `serializer` from `.values()` rows instead of model instances, which skips
+    DRF's per field attribute lookups. Every readable field reads the column of its source, file fields are
+    turned into URLs the way `FileField.to_representation()` does for the stored file.
+    """
+
+    def __init__(self, serializer):
+        self.fields = []
+        model = serializer.Meta.model
+        for field in serializer._readable_fields:
+            if field.source == "*":
+                raise ValueError(f"{field.field_name} has no column to read from.")
+            to_representation = field.to_representation
+            if isinstance(field, serializers.FileField):
+                to_representation = self.get_file_url(field, get_model_field(model, field.source_attrs))
+            self.fields.append((field.field_name, "__".join(field.source_attrs), to_representation))
+        self.lookups = list(dict.fromkeys(lookup for _, lookup, _ in self.fields))
+
+    @staticmethod
+    def get_file_url(field, model_field):
+        use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+        build_url = get_url_builder(model_field.storage, field.context.get("request"))
+
+        def to_representation(name):
+            if not name:
+                return None
+            return build_url(name) if use_url else name
+        return to_representation
+
+    def to_representation(self, row):
+        representation = {}
+        for field_name, lookup, to_representation in self.fields:
+            value = row[lookup]
+            representation[field_name] = None if value is None else to_representation(value)
+        return representation
+
+
+def get_model_field(model, source_attrs):
+    *relations, name = source_attrs
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
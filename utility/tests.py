@@ -0,0 +1,324 @@
+import datetime
+import decimal
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.core.files.storage import default_storage
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from model_bakery import baker
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from utility import media, metrics
+from utility.backends.sqlite3.base import DatabaseWrapper
+from utility.renderers import ORJSONRenderer
+
+
+class MediaServeTest(SimpleTestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        document_root = tempfile.TemporaryDirectory()
+        self.addCleanup(document_root.cleanup)
+        self.document_root = document_root.name
+        os.mkdir(os.path.join(self.document_root, "posters"))
+        for name in ["posters/logo.jpg", "posters/logo.92w.0123456789abcdef.webp"]:
+            with open(os.path.join(self.document_root, name), "wb") as file:
+                file.write(self.content)
+        self.factory = RequestFactory()
+
+    def make_request(self, path="posters/logo.jpg", **headers):
+        request = self.factory.get(f"/media/{path}", **headers)
+        return media.serve(request, path, document_root=self.document_root)
+
+    def read(self, response):
+        content = b"".join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_full_response(self):
+        response = self.make_request()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.read(response), self.content)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], media.DEFAULT_CACHE_CONTROL)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("Last-Modified", response)
+
+    def test_content_addressed_files_are_immutable(self):
+        response = self.make_request("posters/logo.92w.0123456789abcdef.webp")
+        self.read(response)
+        self.assertEqual(response["ETag"], '"0123456789abcdef"')
+        self.assertEqual(response["Cache-Control"], media.IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(response["Content-Type"], "image/webp")
+
+    def test_ranges(self):
+        size = len(self.content)
+        for header, start, end in [
+            ("bytes=0-99", 0, 99),
+            ("bytes=100-", 100, size - 1),
+            ("bytes=-10", size - 10, size - 1),
+            ("bytes=10000-20000", 10000, size - 1),
+        ]:
+            with self.subTest(header=header):
+                response = self.make_request(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+                self.assertEqual(self.read(response), self.content[start:end + 1])
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{size}")
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        response = self.make_request(HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.content)}")
+
+    def test_ignored_ranges(self):
+        etag = self.make_request()["ETag"]
+        for headers in [{"HTTP_RANGE": "bytes=0-1,5-6"}, {"HTTP_RANGE": "bytes=0-1", "HTTP_IF_RANGE": '"stale"'}]:
+            with self.subTest(**headers):
+                response = self.make_request(**headers)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(self.read(response), self.content)
+        response = self.make_request(HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.read(response)
+
+    def test_conditional_get(self):
+        response = self.make_request()
+        self.read(response)
+        response = self.make_request(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["Cache-Control"], media.DEFAULT_CACHE_CONTROL)
+
+    @override_settings(MEDIA_SERVE_MODE="x-accel-redirect", MEDIA_ACCEL_REDIRECT_LOCATION="/protected/")
+    def test_x_accel_redirect(self):
+        response = self.make_request("posters/logo.92w.0123456789abcdef.webp")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/posters/logo.92w.0123456789abcdef.webp")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertEqual(response["Cache-Control"], media.IMMUTABLE_CACHE_CONTROL)
+
+    @override_settings(MEDIA_SERVE_MODE="x-sendfile")
+    def test_x_sendfile(self):
+        response = self.make_request()
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["X-Sendfile"], os.path.join(self.document_root, "posters/logo.jpg"))
+
+    def test_missing_and_outside_files(self):
+        for path in ["posters/missing.jpg", "posters", "../outside.jpg"]:
+            with self.subTest(path=path), self.assertRaises(Http404):
+                self.make_request(path)
+
+    def test_only_safe_methods(self):
+        request = self.factory.post("/media/posters/logo.jpg")
+        response = media.serve(request, "posters/logo.jpg", document_root=self.document_root)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    writers = 8
+    transactions = 25
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "db.sqlite3")
+
+    def make_connection(self, **options):
+        settings_dict = {
+            **connection.settings_dict,
+            "ENGINE": "utility.backends.sqlite3",
+            "NAME": self.path,
+            "OPTIONS": {
+                "transaction_mode": "IMMEDIATE",
+                "pragmas": {"busy_timeout": 10000, "journal_mode": "WAL", "synchronous": "NORMAL"},
+                **options,
+            },
+        }
+        wrapper = DatabaseWrapper(settings_dict, alias="stress")
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_pragmas(self):
+        wrapper = self.make_connection()
+        with wrapper.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 10000)
+            cursor.execute("PRAGMA foreign_keys")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_concurrent_writers(self):
+        # Every transaction reads, does some work and then writes, which fails with "database is locked"
+        # under the default deferred transactions as soon as two writers overlap.
+        with self.make_connection().cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)")
+            cursor.execute("INSERT INTO counter VALUES (1, 0)")
+        errors = []
+        barrier = threading.Barrier(self.writers)
+
+        def write():
+            wrapper = self.make_connection()
+            wrapper.inc_thread_sharing()
+            barrier.wait()
+            for _ in range(self.transactions):
+                try:
+                    wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+                    with wrapper.cursor() as cursor:
+                        cursor.execute("SELECT value FROM counter WHERE id = 1")
+                        value = cursor.fetchone()[0]
+                        time.sleep(0.001)
+                        cursor.execute("UPDATE counter SET value = %s WHERE id = 1", [value + 1])
+                    wrapper.commit()
+                except DatabaseError as e:
+                    errors.append(e)
+                    wrapper.rollback()
+                finally:
+                    wrapper.set_autocommit(True)
+
+        threads = [threading.Thread(target=write) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with self.make_connection().cursor() as cursor:
+            cursor.execute("SELECT value FROM counter WHERE id = 1")
+            self.assertEqual(cursor.fetchone()[0], self.writers * self.transactions)
+
+
+class ORJSONRendererTest(SimpleTestCase):
+    def test_same_output_as_json_renderer(self):
+        data = {
+            "text": "caf\u00e9 \u2028 \u2029 \"quoted\" \x00 </script>",
+            "numbers": [0, -1, 2 ** 62, 0.1, 4.066666666666666, 80.0, 1e15],
+            "nested": {"none": None, "bool": True, "list": []},
+            "datetime": datetime.datetime(2023, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            "date": datetime.date(2023, 5, 1),
+            "decimal": decimal.Decimal("1.50"),
+            "uuid": uuid.UUID(int=1),
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+    def test_indent(self):
+        data = {"a": [1, 2]}
+        self.assertEqual(
+            ORJSONRenderer().render(data, "application/json; indent=2"),
+            JSONRenderer().render(data, "application/json; indent=2"),
+        )
+
+
+class UrlBuilderTest(SimpleTestCase):
+    def test_same_urls_as_storage(self):
+        request = RequestFactory().get("/movie/")
+        names = ["logo.jpg", "movies/caf\u00e9 #1?.jpg", "a//b.jpg", "a/./b.jpg", "a/../b.jpg", "/a.jpg", ".hidden"]
+        for request in (request, None):
+            build_url = media.get_url_builder(default_storage, request)
+            for name in names:
+                with self.subTest(name=name, request=request):
+                    url = default_storage.url(name)
+                    self.assertEqual(build_url(name), request.build_absolute_uri(url) if request else url)
+
+
+@override_settings(METRICS_TOKEN="secret")
+class MetricsTest(APITestCase):
+    def setUp(self):
+        baker.make("movie.Movie", _quantity=3)
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+
+    def get_timings(self, response):
+        return {
+            entry.split(";")[0].strip(): entry.split(";", 1)[1]
+            for entry in response["Server-Timing"].split(",")
+        }
+
+    def get_metrics(self):
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        return response.content.decode().splitlines()
+
+    def test_server_timing(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("movie:list")))
+
+        staff = baker.make(User, is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=staff).key}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("movie:list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = self.get_timings(response)
+        self.assertEqual(set(timings), {"total", "view", "db", "auth", "render"})
+        self.assertIn(f'desc="{len(queries)} queries"', timings["db"])
+
+    @override_settings(METRICS_PUBLIC_SERVER_TIMING=True)
+    def test_public_server_timing(self):
+        self.assertIn("Server-Timing", self.client.get(reverse("movie:list")))
+
+    def test_histograms(self):
+        self.client.get(reverse("movie:list"))
+        self.client.get(reverse("movie:list"))
+        self.client.get("/no-such-page/")
+        self.client.generic("PROPFIND", reverse("movie:list"))
+        lines = self.get_metrics()
+        labels = 'view="movie:list",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels},status="200"}} 2', lines)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},status="200",le="+Inf"}} 2', lines)
+        self.assertIn(f'http_request_phase_duration_seconds_count{{{labels},phase="db"}} 2', lines)
+        self.assertIn(f'http_request_db_queries_count{{{labels}}} 2', lines)
+        self.assertIn('http_request_db_queries_count{view="movie:list",method="OTHER"} 1', lines)
+        self.assertTrue(any('view="<unmatched>"' in line and 'status="404"' in line for line in lines))
+
+    def test_worker_histograms_are_summed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        snapshots = metrics.SnapshotDirectory()
+        self.addCleanup(lambda: snapshots.timer and snapshots.timer.cancel())
+        other_worker = {
+            "http_request_db_queries": [[["movie:list", "GET"], [[0, 0, 3] + [0] * 9, 6.0]]],
+        }
+        with open(os.path.join(directory.name, "histograms-0.json"), "w", encoding="utf-8") as file:
+            json.dump(other_worker, file)
+
+        with override_settings(METRICS_DIR=directory.name), mock.patch.object(metrics, "snapshots", snapshots):
+            self.client.get(reverse("movie:list"))
+            lines = self.get_metrics()
+        self.assertIn('http_request_db_queries_count{view="movie:list",method="GET"} 4', lines)
+        self.assertTrue(os.path.exists(os.path.join(directory.name, f"histograms-{os.getpid()}.json")))
+
+    @override_settings(METRICS_TOKEN="")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, status.HTTP_401_UNAUTHORIZED)
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(METRICS_SAMPLE_RATE=0, METRICS_PUBLIC_SERVER_TIMING=True)
+    def test_not_sampled(self):
+        with mock.patch.object(metrics.random, "random", return_value=0.0):
+            response = self.client.get(reverse("movie:list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Server-Timing", response)
+        for histogram in metrics.HISTOGRAMS:
+            self.assertEqual(histogram.snapshot(), {})
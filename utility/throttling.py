@@ -0,0 +1,83 @@
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from utility.cache import LRUCache
+
+# Per-process buckets. A key that has not been seen for a day has a full bucket again under any sane rate.
+throttle_buckets = LRUCache(max_entries=settings.AUTH_THROTTLE_MAX_ENTRIES, timeout=24 * 60 * 60)
+throttle_lock = threading.Lock()
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Parse a DRF style rate such as "10/min" into the bucket capacity and the tokens refilled per second.
+    """
+    count, period = rate.split("/")
+    return int(count), int(count) / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle. Every key holds up to `count` tokens of its rate, a request takes one and tokens
+    flow back continuously at `count` per period, so clients get bursts without exceeding the rate. DRF
+    checks throttles before the handler runs, so rejected requests never reach password hashing.
+    """
+    rate_name = None
+    methods = ["POST"]
+
+    def get_rate(self):
+        return settings.AUTH_THROTTLE_RATES.get(self.rate_name)
+
+    def get_key(self, request, view):
+        raise NotImplementedError(".get_key() must be overridden")
+
+    def allow_request(self, request, view):
+        rate = self.get_rate()
+        if rate is None or request.method not in self.methods:
+            return True
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        key = f"{self.rate_name}:{key}"
+        capacity, refill_rate = parse_rate(rate)
+        now = time.monotonic()
+        with throttle_lock:
+            tokens, updated_at = throttle_buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            throttle_buckets.set(key, (tokens, now))
+        self.wait_seconds = None if allowed else (1 - tokens) / refill_rate
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPThrottle(TokenBucketThrottle):
+    rate_name = "ip"
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class UsernameThrottle(TokenBucketThrottle):
+    """
+    Throttles by the username in the URL or the request body, so one account cannot be brute forced from
+    many addresses.
+    """
+    rate_name = "username"
+
+    def get_key(self, request, view):
+        username = view.kwargs.get("username")
+        if username is None and hasattr(request.data, "get"):
+            username = request.data.get("username")
+        if not isinstance(username, str) or not username:
+            return None
+        return username.lower()
@@ -0,0 +1,149 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from utility.renderers import ORJSONRenderer
+from utility.serializers import ValuesRepresentation
+
+
+class AsyncAPIView(APIView):
+    """
+    Async counterpart of `APIView` for endpoints served under ASGI. Handlers are coroutines that return DRF
+    responses. The request goes through the same `initial()` as sync views (content negotiation, versioning,
+    authentication, permissions and throttles) in one worker thread, since authenticators and throttles may
+    query the database or the cache synchronously.
+    """
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # `APIView.as_view()` wraps the view in `csrf_exempt()`, whose wrapper is a plain function that Django
+        # would run in a thread. `View.as_view()` marks it as a coroutine function instead.
+        view = super(APIView, cls).as_view(**initkwargs)
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS is answered by the sync `APIView.options()`.
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        # JSON is rendered here, on the event loop. The browsable API is left to Django, which renders it in
+        # a thread because its forms may query the database.
+        if isinstance(self.response, Response) and not isinstance(request.accepted_renderer, BrowsableAPIRenderer):
+            self.response.render()
+        return self.response
+
+
+class ValuesListMixin:
+    """
+    ListModelMixin counterpart that, when FAST_LIST_SERIALIZATION is on, builds the page from `.values()`
+    rows with `ValuesRepresentation` instead of serializing model instances, and renders it with orjson.
+    """
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_LIST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        representation = ValuesRepresentation(self.get_serializer(many=True).child)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.values(*get_values_lookups(representation, self.paginator, request)))
+        return self.get_paginated_response([representation.to_representation(row) for row in page])
+
+
+def get_values_lookups(representation, paginator, request):
+    # The paginator reads its cursor from the rows, so they also carry the ordering field.
+    ordering_field = paginator.get_ordering(request).lstrip("-")
+    return list(dict.fromkeys([*representation.lookups, ordering_field, paginator.tie_breaker]))
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients pick the fields of the response with `?fields=a,b` or drop some with `?omit=a,b`. The
+    serializer must use `SparseFieldsetSerializerMixin`. Views build their querysets with
+    `is_field_requested()` to skip the annotations and prefetches of fields that are left out, and
+    `trim_queryset()` to load only the columns the remaining fields read.
+    """
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+    # Columns read by fields whose source is not a model field, by field name.
+    field_columns = {}
+
+    @cached_property
+    def sparse_fields(self):
+        """
+        Names of the requested fields, or None when the client did not restrict them.
+        """
+        field_names = self.serializer_class.Meta.fields
+        fields = self.get_field_names(self.fields_query_param, field_names)
+        omit = self.get_field_names(self.omit_query_param, field_names)
+        if fields is None and omit is None:
+            return None
+        return frozenset(fields or field_names) - (omit or frozenset())
+
+    def get_field_names(self, query_param, field_names):
+        value = self.request.query_params.get(query_param)
+        if not value:
+            return None
+        names = frozenset(name.strip() for name in value.split(",") if name.strip())
+        unknown = names.difference(field_names)
+        if unknown:
+            raise ValidationError({
+                query_param: [
+                    _("Unknown fields: %(unknown)s. Fields are: %(fields)s") % {
+                        "unknown": ", ".join(sorted(unknown)),
+                        "fields": ", ".join(field_names),
+                    },
+                ],
+            })
+        return names
+
+    def is_field_requested(self, name):
+        return self.sparse_fields is None or name in self.sparse_fields
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "fields": self.sparse_fields}
+
+    def trim_queryset(self, queryset, *columns):
+        """
+        Restrict `queryset` to the columns read by the requested fields and the given `columns`.
+        """
+        if self.sparse_fields is None:
+            return queryset
+        model = queryset.model
+        columns = {model._meta.pk.name, *columns}
+        for name, field in self.serializer_class(context={"fields": self.sparse_fields}).fields.items():
+            columns.update(self.field_columns.get(name, ()))
+            if not field.source_attrs:
+                continue
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(model_field.name)
+        return queryset.only(*columns)